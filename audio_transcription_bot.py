@@ -1,24 +1,45 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import time
+
+# Время импорта модуля со всеми зависимостями; пишется в лог при запуске
+IMPORT_STARTED = time.perf_counter()
+
 import os
+import re
 import uuid
 import logging
 import asyncio
-import requests
-from datetime import datetime, timedelta
+import hashlib
+import tempfile
+import json
+import functools
 from dotenv import load_dotenv
-from pydub import AudioSegment
 from telegram import Update
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
 from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
-import urllib3
 import shutil
+from collections import namedtuple
+from contextlib import aclosing, contextmanager, nullcontext
+from salute_client import Recognition, SaluteSpeechClient
+from retry_policy import CircuitBreaker, RetryPolicy
+from scheduler import RecognitionScheduler
+from transcript_cache import TranscriptCache
+from progress import ProgressReporter
+from job_queue import JobQueue
+from cpu_pool import CpuPool
+from loop_lag import LoopLagMonitor
+from file_slice import FileSlice
+from memory_budget import MemoryBudget
+from metrics import Registry, start_http_server
+from subtitles import FORMATS as SUBTITLE_FORMATS, SubtitleWriter, hypothesis_segments
+from startup import Startup, check_ffmpeg
+import tracing
 
-# Отключаем предупреждения SSL для тестирования
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-# Настройка логирования
-logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+# Настройка логирования; trace_id — задание, к которому относится строка
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s", level=logging.INFO)
+tracing.install()
 logger = logging.getLogger(__name__)
 
 # Загрузка переменных окружения
@@ -28,171 +49,713 @@ SERVER_URL = os.getenv("SERVER_URL")
 WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
 WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/audio/webhook")
 SALUTE_SPEECH_API_KEY = os.getenv("SALUTE_SPEECH_API_KEY")
+# Адреса API; для локальных тестов и замеров их можно направить на mock_server.py
+SALUTE_OAUTH_URL = os.getenv("SALUTE_OAUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+SALUTE_API_URL = os.getenv("SALUTE_API_URL", "https://smartspeech.sber.ru/rest/v1")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+SALUTE_MAX_CONNECTIONS = int(os.getenv("SALUTE_MAX_CONNECTIONS", 20))
+SALUTE_TOKEN_TIMEOUT = float(os.getenv("SALUTE_TOKEN_TIMEOUT", 10))
+SALUTE_RECOGNIZE_TIMEOUT = float(os.getenv("SALUTE_RECOGNIZE_TIMEOUT", 120))
+# За сколько секунд до истечения токена запрашивать новый в фоне
+SALUTE_TOKEN_REFRESH_MARGIN = float(os.getenv("SALUTE_TOKEN_REFRESH_MARGIN", 300))
+# Записи не короче ASYNC_MIN_DURATION_S секунд распознаются одной асинхронной задачей
+# вместо нарезки на фрагменты; 0 отключает асинхронный режим
+ASYNC_MIN_DURATION_S = float(os.getenv("ASYNC_MIN_DURATION_S", 600))
+SALUTE_ASYNC_POLL_INTERVAL = float(os.getenv("SALUTE_ASYNC_POLL_INTERVAL", 2))
+SALUTE_ASYNC_TIMEOUT = float(os.getenv("SALUTE_ASYNC_TIMEOUT", 3600))
+# Сколько фрагментов распознаётся одновременно: всего и на одного пользователя
+SALUTE_MAX_CONCURRENCY = int(os.getenv("SALUTE_MAX_CONCURRENCY", 4))
+PER_USER_MAX_CONCURRENCY = int(os.getenv("PER_USER_MAX_CONCURRENCY", 2))
+# Повторы при временных сбоях (429, 5xx, обрывы соединения): число попыток и границы паузы
+SALUTE_RETRY_ATTEMPTS = int(os.getenv("SALUTE_RETRY_ATTEMPTS", 4))
+SALUTE_RETRY_BASE_DELAY = float(os.getenv("SALUTE_RETRY_BASE_DELAY", 1))
+SALUTE_RETRY_MAX_DELAY = float(os.getenv("SALUTE_RETRY_MAX_DELAY", 30))
+# После SALUTE_BREAKER_THRESHOLD сбоев подряд все запросы ждут SALUTE_BREAKER_RESET секунд;
+# дольше SALUTE_BREAKER_MAX_WAIT запрос не ждёт и завершается ошибкой
+SALUTE_BREAKER_THRESHOLD = int(os.getenv("SALUTE_BREAKER_THRESHOLD", 5))
+SALUTE_BREAKER_RESET = float(os.getenv("SALUTE_BREAKER_RESET", 30))
+SALUTE_BREAKER_MAX_WAIT = float(os.getenv("SALUTE_BREAKER_MAX_WAIT", 600))
+# Прогрев при запуске: сколько соединений с API открыть заранее, сколько ждать прогрева
+# (в том числе процессов-обработчиков) до приёма обновлений и как часто повторять неудавшийся прогрев
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", 0)) or None
+STARTUP_WARMUP_TIMEOUT = float(os.getenv("STARTUP_WARMUP_TIMEOUT", 30))
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", 30))
 
 # Пути к инструментам и временным файлам
 if os.name == "nt":
     FFMPEG_BIN = os.path.join(os.getcwd(), "ffmpeg", "bin", "ffmpeg.exe")
 else:
     FFMPEG_BIN = "ffmpeg"
-TEMP_DIR = os.path.join(os.getcwd(), "temp")
+TEMP_DIR = os.getenv("TEMP_DIR", os.path.join(os.getcwd(), "temp"))
 os.makedirs(TEMP_DIR, exist_ok=True)
+# Рабочие каталоги заданий старше TEMP_MAX_AGE считаются брошенными после сбоя
+TEMP_MAX_AGE = int(os.getenv("TEMP_MAX_AGE", 6 * 3600))
+TEMP_JANITOR_INTERVAL = int(os.getenv("TEMP_JANITOR_INTERVAL", 600))
+
+# Формат, который принимает Salute Speech: 16 кГц, моно, 16 бит
+PCM_SAMPLE_RATE = 16000
+PCM_SAMPLE_WIDTH = 2
+PIPE_READ_SIZE = 64 * 1024
+# Максимальная длина фрагмента и окно перед ней, в котором ищется пауза для разреза
+MAX_CHUNK_DURATION_MS = int(os.getenv("MAX_CHUNK_DURATION_MS", 60000))
+VAD_SEARCH_WINDOW_MS = int(os.getenv("VAD_SEARCH_WINDOW_MS", 10000))
+
+# Кэш распознанных текстов; пустой путь отключает кэш
+TRANSCRIPT_CACHE_PATH = os.getenv("TRANSCRIPT_CACHE_PATH", os.path.join(os.getcwd(), "transcript_cache.sqlite3"))
+TRANSCRIPT_CACHE_MAX_MB = int(os.getenv("TRANSCRIPT_CACHE_MAX_MB", 200))
+TRANSCRIPT_CACHE_TTL_DAYS = int(os.getenv("TRANSCRIPT_CACHE_TTL_DAYS", 30))
+
+# Файлы не больше IN_MEMORY_MAX_BYTES скачиваются и конвертируются в памяти, без временных файлов.
+# Контейнеры, которым ffmpeg нужен произвольный доступ (moov в конце файла), из канала не читаются
+IN_MEMORY_MAX_BYTES = int(os.getenv("IN_MEMORY_MAX_BYTES", 2 * 1024 * 1024))
+PIPE_UNSAFE_FORMATS = {"m4a", "mp4", "mov"}
+# Память под аудиоданные: на всё процесс и на одно задание в памяти. Задания на диске держат
+# в памяти только окно нарезки, фрагменты читаются из PCM-файла задания через mmap
+MEMORY_BUDGET_MB = int(os.getenv("MEMORY_BUDGET_MB", 256))
+JOB_MEMORY_BUDGET_MB = int(os.getenv("JOB_MEMORY_BUDGET_MB", 64))
+# Как часто (в секундах) можно править статусное сообщение с промежуточным текстом
+PROGRESS_UPDATE_INTERVAL = float(os.getenv("PROGRESS_UPDATE_INTERVAL", 3))
+# Формат результата по умолчанию: text — только текст; srt, vtt или json — ещё и файл с временными
+# метками. Пользователь меняет его командой /format
+OUTPUT_FORMATS = ("text",) + SUBTITLE_FORMATS
+DEFAULT_OUTPUT_FORMAT = os.getenv("DEFAULT_OUTPUT_FORMAT", "text")
+# Готовые субтитры ждут доставки файлами в этом каталоге (общем для бота и обработчиков)
+SUBTITLES_DIR = os.getenv("SUBTITLES_DIR", os.path.join(os.getcwd(), "subtitles"))
+os.makedirs(SUBTITLES_DIR, exist_ok=True)
+
+# Очередь заданий: бот только принимает файлы, распознают отдельные процессы (job_worker.py).
+# JOB_WORKERS=0 — бот не запускает обработчики сам, их запускают отдельно
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", os.path.join(os.getcwd(), "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", 2))
+# Аренда задания продлевается, пока обработчик жив; после её истечения задание выдаётся заново
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 60))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 0.5))
+JOB_DELIVERY_INTERVAL = float(os.getenv("JOB_DELIVERY_INTERVAL", 1))
+# Доставка при сетевых сбоях Telegram: попыток на задание и предел паузы между ними (растёт вдвое)
+JOB_DELIVERY_ATTEMPTS = int(os.getenv("JOB_DELIVERY_ATTEMPTS", 12))
+JOB_DELIVERY_MAX_DELAY = float(os.getenv("JOB_DELIVERY_MAX_DELAY", 300))
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", 7 * 24 * 3600))
+# Как часто бот проверяет, живы ли запущенные им обработчики, и перезапускает упавшие
+WORKER_CHECK_INTERVAL = float(os.getenv("WORKER_CHECK_INTERVAL", 5))
+
+# Приём заданий. Стоимость задания — секунды аудио: длительность от Telegram или оценка по размеру
+# файла (у документов длительности нет). Задания до PRIORITY_MAX_DURATION идут вне общей очереди
+PRIORITY_MAX_DURATION = int(os.getenv("PRIORITY_MAX_DURATION", 60))
+ESTIMATE_BYTES_PER_SECOND = int(os.getenv("ESTIMATE_BYTES_PER_SECOND", 16000))
+# Ограничения (0 — без ограничения): длина одного файла, заданий одного пользователя в очереди
+# и суммарная длительность очереди, сверх которой принимаются только короткие записи
+MAX_JOB_DURATION = int(os.getenv("MAX_JOB_DURATION", 4 * 3600))
+MAX_QUEUED_PER_USER = int(os.getenv("MAX_QUEUED_PER_USER", 5))
+MAX_QUEUE_DURATION = int(os.getenv("MAX_QUEUE_DURATION", 6 * 3600))
+# Справедливая очередь: за сколько секунд учитывать обслуженное пользователю аудио и веса
+# пользователей в виде "id:вес,id:вес" (по умолчанию вес 1)
+FAIR_WINDOW = int(os.getenv("FAIR_WINDOW", 3600))
+USER_WEIGHTS = {
+    int(user_id): float(weight)
+    for user_id, weight in (item.split(":") for item in os.getenv("USER_WEIGHTS", "").split(",") if item.strip())
+}
+# Как часто обновлять место в очереди в статусных сообщениях, с
+QUEUE_POSITION_INTERVAL = float(os.getenv("QUEUE_POSITION_INTERVAL", 10))
+
+# Пул процессов для поиска пауз; по умолчанию ядра делятся между обработчиками очереди.
+# CPU_POOL_WORKERS=0 — считать прямо в event loop
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", max(1, (os.cpu_count() or 1) // max(JOB_WORKERS, 1))))
+CPU_POOL_MAX_PENDING = int(os.getenv("CPU_POOL_MAX_PENDING", 0)) or None
+# Задержка event loop: как часто писать сводку в лог и с какой задержки предупреждать
+LOOP_LAG_REPORT_INTERVAL = float(os.getenv("LOOP_LAG_REPORT_INTERVAL", 60))
+LOOP_LAG_WARN_MS = float(os.getenv("LOOP_LAG_WARN_MS", 100))
+# Эндпоинт /metrics: бот слушает METRICS_PORT, N-й обработчик очереди — METRICS_PORT + N; 0 отключает
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+
+# Фрагмент аудио в PCM и его положение в исходном файле. data — PCM фрагмента: FileSlice
+# PCM-файла задания (path) или срез буфера в памяти (path=None)
+AudioChunk = namedtuple("AudioChunk", ["path", "offset_ms", "duration_ms", "data"], defaults=(None,))
 
-# Переменные для хранения токена Salute Speech API
-access_token = None
-token_expiration = datetime.now()
+# Общий клиент Salute Speech API с пулом соединений
+salute_client = SaluteSpeechClient(
+    SALUTE_SPEECH_API_KEY,
+    max_connections=SALUTE_MAX_CONNECTIONS,
+    token_timeout=SALUTE_TOKEN_TIMEOUT,
+    recognize_timeout=SALUTE_RECOGNIZE_TIMEOUT,
+    token_refresh_margin=SALUTE_TOKEN_REFRESH_MARGIN,
+    async_poll_interval=SALUTE_ASYNC_POLL_INTERVAL,
+    async_timeout=SALUTE_ASYNC_TIMEOUT,
+    retry_policy=RetryPolicy(SALUTE_RETRY_ATTEMPTS, SALUTE_RETRY_BASE_DELAY, SALUTE_RETRY_MAX_DELAY),
+    circuit_breaker=CircuitBreaker(SALUTE_BREAKER_THRESHOLD, SALUTE_BREAKER_RESET, SALUTE_BREAKER_MAX_WAIT),
+    oauth_url=SALUTE_OAUTH_URL,
+    api_url=SALUTE_API_URL,
+)
+recognition_scheduler = RecognitionScheduler(SALUTE_MAX_CONCURRENCY, PER_USER_MAX_CONCURRENCY)
 
-def clear_temp_dir():
+def share_recognition_limit(processes):
+    # Квота Salute Speech общая на аккаунт, а семафоры планировщика — на процесс:
+    # processes обработчиков очереди делят SALUTE_MAX_CONCURRENCY поровну
+    global recognition_scheduler
+    limit = max(1, SALUTE_MAX_CONCURRENCY // processes)
+    if limit * processes > SALUTE_MAX_CONCURRENCY:
+        logger.warning(
+            f"SALUTE_MAX_CONCURRENCY={SALUTE_MAX_CONCURRENCY} меньше числа обработчиков ({processes}): "
+            f"одновременных распознаваний будет до {limit * processes}"
+        )
+    recognition_scheduler = RecognitionScheduler(limit, PER_USER_MAX_CONCURRENCY)
+transcript_cache = TranscriptCache(
+    TRANSCRIPT_CACHE_PATH,
+    max_bytes=TRANSCRIPT_CACHE_MAX_MB * 1024 * 1024,
+    ttl=TRANSCRIPT_CACHE_TTL_DAYS * 24 * 3600,
+)
+job_queue = JobQueue(JOB_QUEUE_PATH, fair_window=FAIR_WINDOW, user_weights=USER_WEIGHTS)
+cpu_pool = CpuPool(CPU_POOL_WORKERS, CPU_POOL_MAX_PENDING)
+memory_budget = MemoryBudget(MEMORY_BUDGET_MB * 1024 * 1024)
+loop_lag = LoopLagMonitor(report_interval=LOOP_LAG_REPORT_INTERVAL, warn_threshold=LOOP_LAG_WARN_MS / 1000)
+
+# Метрики процесса. Значения, которые уже считают очередь, кэш и клиент API, читаются при запросе
+metrics = Registry()
+stage_seconds = metrics.histogram(
+    "audio_bot_stage_seconds",
+    "Длительность этапов: download, decode, encode, scheduler_wait, recognize, async_recognize, "
+    "queue_wait, job, deliver",
+    ["stage"]
+)
+chunks_in_flight = metrics.gauge("audio_bot_chunks_in_flight", "Фрагменты, распознаваемые прямо сейчас")
+audio_bytes_total = metrics.counter("audio_bot_audio_bytes_total", "Скачано байт исходного аудио")
+audio_seconds_total = metrics.counter("audio_bot_audio_seconds_total", "Распознано секунд аудио")
+realtime_factor = metrics.histogram(
+    "audio_bot_realtime_factor", "Секунд аудио на секунду работы за задание",
+    buckets=(0.5, 1, 2, 5, 10, 20, 50, 100, 200)
+)
+jobs_total = metrics.counter("audio_bot_jobs_total", "Завершённые задания по результату", ["result"])
+jobs_rejected_total = metrics.counter("audio_bot_jobs_rejected_total", "Не принятые в очередь задания", ["reason"])
+worker_restarts_total = metrics.counter("audio_bot_worker_restarts_total", "Перезапуски упавших процессов-обработчиков")
+metrics.gauge(
+    "audio_bot_queue_jobs", "Задания в очереди по состояниям", ["state"], callback=lambda: job_queue.counts()
+)
+metrics.counter(
+    "audio_bot_salute_requests_total", "Запросы к Salute Speech по видам (oauth — обновления токена)", ["kind"],
+    callback=lambda: dict(salute_client.request_counts)
+)
+metrics.counter(
+    "audio_bot_salute_token_refreshes_total", "Получения OAuth-токена",
+    callback=lambda: {(): salute_client.request_counts["oauth"]}
+)
+metrics.counter(
+    "audio_bot_salute_retries_total", "Повторы запросов по классам ошибок", ["error_class"],
+    callback=lambda: dict(salute_client.retry_counts)
+)
+metrics.gauge(
+    "audio_bot_salute_circuit_open", "1, если запросы к API приостановлены",
+    callback=lambda: {(): int(salute_client.breaker.is_open)}
+)
+metrics.counter(
+    "audio_bot_cache_lookups_total", "Обращения к кэшу текстов", ["kind", "result"],
+    callback=lambda: {
+        (kind, result): stats[key]
+        for kind, stats in transcript_cache.stats().items()
+        for result, key in (("hit", "hits"), ("miss", "misses"))
+    }
+)
+metrics.gauge(
+    "audio_bot_memory_reserved_bytes", "Память, занятая аудиоданными заданий",
+    callback=lambda: {(): memory_budget.used}
+)
+metrics.gauge("audio_bot_loop_lag_seconds", "Последняя задержка event loop", callback=lambda: {(): loop_lag.last_lag})
+metrics.counter(
+    "audio_bot_cpu_pool_saturated_total", "Сколько раз пришлось ждать места в пуле процессов",
+    callback=lambda: {(): cpu_pool.saturated}
+)
+
+metrics.gauge("audio_bot_ready", "1, если процесс прогрет и готов к работе", callback=lambda: {(): int(startup.is_ready())})
+metrics.gauge(
+    "audio_bot_startup_seconds", "Длительность этапов запуска процесса", ["phase"],
+    callback=lambda: dict(startup.phases)
+)
+
+# Этапы запуска и готовность; импорт к этому моменту закончен
+startup = Startup(import_seconds=time.perf_counter() - IMPORT_STARTED)
+
+# Каталоги заданий, которые сейчас в работе: уборщик их не трогает
+active_workspaces = set()
+
+@contextmanager
+def job_workspace():
+    # Каждое задание пишет только в свой каталог и удаляет только его,
+    # поэтому параллельные задания не стирают чужие фрагменты
+    path = tempfile.mkdtemp(prefix="job_", dir=TEMP_DIR)
+    active_workspaces.add(path)
+    try:
+        yield path
+    finally:
+        active_workspaces.discard(path)
+        shutil.rmtree(path, ignore_errors=True)
+
+def cleanup_orphaned_temp(max_age=TEMP_MAX_AGE):
+    # Удаляет то, что осталось во временном каталоге после падения процесса
+    deadline = time.time() - max_age
     for f in os.listdir(TEMP_DIR):
+        path = os.path.join(TEMP_DIR, f)
+        if path in active_workspaces:
+            continue
         try:
-            file_path = os.path.join(TEMP_DIR, f)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
+            if os.path.getmtime(path) > deadline:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            logger.info(f"Удалён брошенный временный файл {f}")
         except Exception as e:
             logger.warning(f"Не удалось удалить {f}: {e}")
 
-def get_salute_token():
-    global access_token, token_expiration
-    if access_token and token_expiration > datetime.now() + timedelta(minutes=1):
-        return access_token
-    url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-    payload = {"scope": "SALUTE_SPEECH_PERS"}
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Accept": "application/json",
-        "RqUID": str(uuid.uuid4()),
-        "Authorization": f"Basic {SALUTE_SPEECH_API_KEY}"
-    }
+async def touch_workspaces():
+    # Janitor работает в процессе бота, а задания — в обработчиках, и их active_workspaces ему не видны.
+    # Поэтому процесс с заданиями обновляет время изменения своих каталогов: живой каталог никогда
+    # не выглядит брошенным, сколько бы ни длилось задание
+    while True:
+        await asyncio.sleep(min(TEMP_JANITOR_INTERVAL, TEMP_MAX_AGE / 2))
+        for path in list(active_workspaces):
+            try:
+                os.utime(path)
+            except OSError as e:
+                logger.warning(f"Не удалось обновить время каталога {path}: {e}")
+
+async def temp_janitor():
+    while True:
+        cleanup_orphaned_temp()
+        job_queue.purge_delivered(JOB_RETENTION)
+        await asyncio.sleep(TEMP_JANITOR_INTERVAL)
+
+async def get_salute_token():
+    return await salute_client.get_token()
+
+async def verify_ffmpeg():
+    with startup.phase("ffmpeg"):
+        try:
+            version, missing = await check_ffmpeg(FFMPEG_BIN)
+        except Exception as e:
+            logger.error(f"ffmpeg ({FFMPEG_BIN}) не запускается: {e}")
+            return False
+    logger.info(version)
+    if missing:
+        logger.warning(f"В ffmpeg нет нужных кодеков: {', '.join(missing)}; такие файлы распознать не получится")
+    return True
+
+async def warm_up():
+    # Всё, что иначе досталось бы первому заданию после запуска: ffmpeg, OAuth-токен,
+    # TLS-соединения с API и процессы пула с импортированным numpy. Возвращает True, если всё удалось
+    if not await verify_ffmpeg():
+        return False
     try:
-        response = requests.post(url, headers=headers, data=payload, timeout=10, verify=False)
-        response.raise_for_status()
-        response_data = response.json()
-        access_token = response_data["access_token"]
-        expires_at = datetime.fromtimestamp(response_data["expires_at"] / 1000)
-        token_expiration = expires_at
-        logger.info(f"Получен токен, действителен до {expires_at}")
-        return access_token
+        with startup.phase("token"):
+            # tokens.get, а не get_token: ошибка OAuth должна прервать прогрев, а не превратиться в None
+            await salute_client.tokens.get()
     except Exception as e:
-        logger.error(f"Ошибка получения токена: {e}")
+        logger.warning(f"Не удалось получить токен Salute Speech при запуске: {e}")
+        return False
+    with startup.phase("connections"):
+        # По умолчанию по соединению на каждое распознавание, которое процессу разрешено вести одновременно
+        connections = WARMUP_CONNECTIONS or recognition_scheduler.global_limit
+        opened = await salute_client.warm_up(connections)
+    if opened < connections:
+        logger.warning(f"При запуске открыто {opened} из {connections} соединений с Salute Speech")
+        return False
+    with startup.phase("cpu_pool"):
+        from vad import find_cut_point
+        # Секунда тишины: сама нарезка не важна, важно, чтобы процессы запустились и импортировали vad
+        await cpu_pool.warm_up(find_cut_point, bytes(PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH), 0)
+    return True
+
+async def keep_warming(ready=None):
+    # Повторяет прогрев, пока он не удастся: задания тем временем обрабатываются как обычно,
+    # просто первые из них платят за холодный старт. ready — multiprocessing.Event для процесса бота
+    while not await warm_up():
+        await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+    startup.ready = True
+    if ready is not None:
+        ready.set()
+    logger.info(f"Процесс прогрет за {time.monotonic() - startup.started:.2f} с: {startup.summary()}")
+
+async def probe_duration(audio_path):
+    # ffmpeg без выходного файла только читает заголовки и печатает длительность в stderr
+    proc = await asyncio.create_subprocess_exec(
+        FFMPEG_BIN, "-hide_banner", "-i", audio_path,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await proc.communicate()
+    match = re.search(rb"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", stderr)
+    if not match:
         return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
 
-async def prepare_audio(audio_path):
-    output_path = os.path.join(TEMP_DIR, f"{uuid.uuid4()}.pcm")
+async def encode_for_upload(audio_path, workspace=TEMP_DIR):
+    # Для асинхронного режима файл загружается целиком: FLAC 16 кГц моно без потерь,
+    # но примерно вдвое меньше сырого PCM
+    output_path = os.path.join(workspace, f"{uuid.uuid4()}.flac")
     command = [
-        FFMPEG_BIN, "-i", audio_path, "-acodec", "pcm_s16le", "-ac", "1", "-ar", "16000", "-f", "s16le", output_path
+        FFMPEG_BIN, "-v", "error", "-i", audio_path, "-vn",
+        "-ac", "1", "-ar", str(PCM_SAMPLE_RATE), "-sample_fmt", "s16", "-c:a", "flac", output_path
     ]
-    proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-    _, stderr = await proc.communicate()
+    with stage_seconds.time(stage="encode"):
+        proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        _, stderr = await proc.communicate()
     if proc.returncode != 0:
-        logger.error(f"Ошибка конвертации аудио: {stderr.decode()}")
-        raise Exception("Ошибка при конвертации аудио")
+        stderr = stderr.decode(errors="replace").strip()
+        logger.error(f"Ошибка конвертации аудио: {stderr}")
+        raise ValueError(f"Невозможно открыть аудиофайл: {stderr.splitlines()[-1] if stderr else proc.returncode}")
     return output_path
 
-async def split_audio(audio_path, max_duration_ms=60000):
+async def prepare_audio_bytes(audio_data):
+    # Декодирование без диска: исходник подаётся в stdin ffmpeg, PCM читается из stdout
+    command = [
+        FFMPEG_BIN, "-v", "error", "-i", "pipe:0", "-vn",
+        "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(PCM_SAMPLE_RATE), "-f", "s16le", "pipe:1"
+    ]
+    proc = await asyncio.create_subprocess_exec(
+        *command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    with stage_seconds.time(stage="decode"):
+        pcm, stderr = await proc.communicate(audio_data)
+    if proc.returncode != 0:
+        stderr = stderr.decode(errors="replace").strip()
+        logger.error(f"Ошибка конвертации аудио: {stderr}")
+        raise ValueError(f"Невозможно открыть аудиофайл: {stderr.splitlines()[-1] if stderr else proc.returncode}")
+    return pcm[:len(pcm) - len(pcm) % PCM_SAMPLE_WIDTH]
+
+def sha256_hex(data):
+    # hashlib отпускает GIL на больших буферах, поэтому хэш считается в потоке
+    if isinstance(data, FileSlice):
+        return data.digest()
+    return hashlib.sha256(data).hexdigest()
+
+async def choose_cut_point(pcm, search_start):
+    # numpy нужен только процессам, которые режут аудио: процесс бота, который лишь ставит
+    # задания в очередь, его не импортирует
+    from vad import find_cut_point
+    # В пул процессов передаётся только окно поиска паузы, а не весь фрагмент
+    window = bytes(pcm[search_start * PCM_SAMPLE_WIDTH:])
+    return search_start + await cpu_pool.run(find_cut_point, window, 0)
+
+def append_chunk(pcm_file, data, offset_samples):
+    # Фрагменты пишутся подряд в один PCM-файл задания, поэтому смещение в файле
+    # совпадает со смещением фрагмента в записи
+    pcm_file.write(data)
+    pcm_file.flush()
+    samples = len(data) // PCM_SAMPLE_WIDTH
+    return AudioChunk(
+        pcm_file.name,
+        offset_samples * 1000 // PCM_SAMPLE_RATE,
+        samples * 1000 // PCM_SAMPLE_RATE,
+        FileSlice(pcm_file.name, offset_samples * PCM_SAMPLE_WIDTH, len(data))
+    )
+
+async def iter_audio_chunks(audio_path, workspace=TEMP_DIR, max_duration_ms=MAX_CHUNK_DURATION_MS,
+                            search_window_ms=VAD_SEARCH_WINDOW_MS):
+    # Один проход ffmpeg: исходник декодируется один раз прямо в 16 кГц моно s16le.
+    # Граница фрагмента ставится в самом тихом месте последних search_window_ms
+    # перед лимитом длины, чтобы не резать слова посередине
+    max_samples = max_duration_ms * PCM_SAMPLE_RATE // 1000
+    max_bytes = max_samples * PCM_SAMPLE_WIDTH
+    search_start = max(0, max_samples - search_window_ms * PCM_SAMPLE_RATE // 1000)
+    command = [
+        FFMPEG_BIN, "-v", "error", "-i", audio_path, "-vn",
+        "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(PCM_SAMPLE_RATE), "-f", "s16le", "pipe:1"
+    ]
+    # В памяти задание держит только буфер нарезки, не больше одного фрагмента
+    async with memory_budget.reserve(max_bytes + PIPE_READ_SIZE):
+        async with aclosing(_decode_chunks(audio_path, command, workspace, max_bytes, search_start)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+async def _decode_chunks(audio_path, command, workspace, max_bytes, search_start):
+    started = time.monotonic()
+    proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    stderr_task = asyncio.create_task(proc.stderr.read())
+    pcm_file = open(os.path.join(workspace, f"{uuid.uuid4()}.pcm"), "wb")
     try:
-        # Предварительная проверка аудиофайла
-        try:
-            audio = AudioSegment.from_file(audio_path)
-            # Проверка атрибутов для выявления проблем до разделения
-            _ = audio.sample_width
-            _ = audio.frame_rate
-            _ = audio.channels
-        except Exception as e:
-            logger.error(f"Ошибка при открытии аудиофайла {audio_path}: {e}")
-            raise ValueError(f"Невозможно открыть аудиофайл: {e}")
-            
-        if len(audio) <= max_duration_ms:
-            return [audio_path]
-        chunks = []
-        for i, start in enumerate(range(0, len(audio), max_duration_ms)):
-            chunk = audio[start:start+max_duration_ms]
-            chunk_path = os.path.join(TEMP_DIR, f"chunk_{i}_{uuid.uuid4()}.wav")
-            chunk.export(chunk_path, format="wav")
-            chunks.append(chunk_path)
+        buffer = bytearray()
+        offset_samples = 0
+        while True:
+            data = await proc.stdout.read(PIPE_READ_SIZE)
+            if not data:
+                break
+            buffer += data
+            while len(buffer) >= max_bytes:
+                cut = await choose_cut_point(memoryview(buffer)[:max_bytes], search_start)
+                yield await asyncio.to_thread(append_chunk, pcm_file, buffer[:cut * PCM_SAMPLE_WIDTH], offset_samples)
+                del buffer[:cut * PCM_SAMPLE_WIDTH]
+                offset_samples += cut
+        if len(buffer) >= PCM_SAMPLE_WIDTH:
+            yield await asyncio.to_thread(
+                append_chunk, pcm_file, buffer[:len(buffer) - len(buffer) % PCM_SAMPLE_WIDTH], offset_samples
+            )
+        await proc.wait()
+        stderr = await stderr_task
+        if proc.returncode != 0:
+            stderr = stderr.decode(errors="replace").strip()
+            logger.error(f"Ошибка при открытии аудиофайла {audio_path}: {stderr}")
+            raise ValueError(f"Невозможно открыть аудиофайл: {stderr.splitlines()[-1] if stderr else proc.returncode}")
+        # Потребитель генератора только запускает задачи, так что это почти чистое время декодирования
+        stage_seconds.observe(time.monotonic() - started, stage="decode")
+    finally:
+        pcm_file.close()
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        if not stderr_task.done():
+            stderr_task.cancel()
+
+async def split_audio(audio_path, workspace=TEMP_DIR, max_duration_ms=MAX_CHUNK_DURATION_MS):
+    chunks = []
+    try:
+        async for chunk in iter_audio_chunks(audio_path, workspace, max_duration_ms):
+            chunks.append(chunk)
         return chunks
     except Exception as e:
         logger.error(f"Ошибка при разделении аудио: {e}")
+        remove_chunk_files(chunks)
         raise
 
-def transcribe_audio_chunk(audio_path):
-    token = get_salute_token()
-    if not token:
-        raise Exception("Не удалось получить токен для Salute Speech API")
-    with open(audio_path, "rb") as audio_file:
-        audio_content = audio_file.read()
-    url = "https://smartspeech.sber.ru/rest/v1/speech:recognize"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "audio/x-pcm;bit=16;rate=16000"
-    }
-    try:
-        response = requests.post(
-            url, headers=headers, data=audio_content,
-            params={"language": "ru-RU", "model": "general"}, verify=False
+async def iter_memory_chunks(audio_data, max_duration_ms=MAX_CHUNK_DURATION_MS,
+                             search_window_ms=VAD_SEARCH_WINDOW_MS):
+    # Нарезка для небольших файлов целиком в памяти, по тем же правилам, что и iter_audio_chunks
+    max_samples = max_duration_ms * PCM_SAMPLE_RATE // 1000
+    search_start = max(0, max_samples - search_window_ms * PCM_SAMPLE_RATE // 1000)
+    pcm = await prepare_audio_bytes(audio_data)
+    offset_samples = 0
+    total_samples = len(pcm) // PCM_SAMPLE_WIDTH
+    while offset_samples < total_samples:
+        rest = memoryview(pcm)[offset_samples * PCM_SAMPLE_WIDTH:]
+        if total_samples - offset_samples > max_samples:
+            cut = await choose_cut_point(rest[:max_samples * PCM_SAMPLE_WIDTH], search_start)
+        else:
+            cut = total_samples - offset_samples
+        yield AudioChunk(
+            None,
+            offset_samples * 1000 // PCM_SAMPLE_RATE,
+            cut * 1000 // PCM_SAMPLE_RATE,
+            rest[:cut * PCM_SAMPLE_WIDTH]
         )
-        response.raise_for_status()
-        result = response.json()
-        if "status" in result and result["status"] == 200:
-            if "result" in result and len(result["result"]) > 0:
-                return result["result"][0]
-        elif "results" in result and len(result["results"]) > 0:
-            return result["results"][0].get("alternatives", [{}])[0].get("transcript", "")
-        return ""
+        offset_samples += cut
+
+async def recognize_pcm(audio_content, user_id=None):
+    # audio_content — bytes, memoryview или FileSlice; FileSlice уходит в запрос кусками из mmap
+    # Нарезка детерминирована, поэтому одинаковый PCM означает одинаковый текст:
+    # повторно присланный файл и уже распознанные фрагменты упавшего задания
+    # берутся из кэша, не расходуя квоту Salute Speech
+    # Возвращает Recognition: у синхронного метода меток времени нет, поэтому в кэше хватает текста
+    cache_key = f"pcm:{await asyncio.to_thread(sha256_hex, audio_content)}"
+    transcript = transcript_cache.get(cache_key)
+    if transcript is not None:
+        return Recognition(transcript, [{"text": transcript}] if transcript else [])
+    waiting = time.monotonic()
+    async with recognition_scheduler.slot(user_id):
+        stage_seconds.observe(time.monotonic() - waiting, stage="scheduler_wait")
+        chunks_in_flight.inc()
+        try:
+            with stage_seconds.time(stage="recognize"):
+                # Срез буфера копируется только на время запроса
+                recognition = await salute_client.recognize(
+                    audio_content if isinstance(audio_content, FileSlice) else bytes(audio_content)
+                )
+        finally:
+            chunks_in_flight.dec()
+    transcript_cache.set(cache_key, recognition.text)
+    return recognition
+
+def remove_chunk_files(chunks):
+    # Фрагменты одного задания ссылаются на общий PCM-файл
+    for path in {chunk.path for chunk in chunks if chunk.path}:
+        if os.path.exists(path):
+            os.remove(path)
+
+async def transcribe_chunks(chunk_source, job_name, user_id=None, total_duration_ms=None, on_progress=None,
+                            subtitles=None):
+    started = time.monotonic()
+    chunks = []
+    transcripts = []
+    finished = []
+    # Гипотезы фрагментов, ещё не записанных в субтитры
+    hypotheses = []
+    written = 0
+    done_ms = 0
+
+    def report_progress():
+        if on_progress is None:
+            return
+        # Показываем только непрерывное начало текста, чтобы промежуточный результат читался по порядку
+        ready = []
+        for transcript, is_finished in zip(transcripts, finished):
+            if not is_finished:
+                break
+            ready.append(transcript)
+        on_progress(done_ms, total_duration_ms, " ".join(filter(None, ready)))
+
+    def write_subtitles(final=False):
+        # Субтитры пишутся по порядку, как только готово непрерывное начало записи, и гипотезы
+        # записанных фрагментов сразу освобождаются: память не растёт с длиной файла.
+        # В конце записываются и фрагменты после неудавшихся
+        nonlocal written
+        if subtitles is None:
+            return
+        while written < len(chunks) and (finished[written] or final):
+            chunk = chunks[written]
+            subtitles.add(hypothesis_segments(
+                hypotheses[written] or [], chunk.offset_ms / 1000, chunk.duration_ms / 1000
+            ))
+            hypotheses[written] = None
+            written += 1
+
+    async def recognize_chunk(i):
+        nonlocal done_ms
+        chunk = chunks[i]
+        # Фрагменты уже в PCM, поэтому распознаём сразу, соблюдая лимиты параллельности
+        recognition = await recognize_pcm(chunk.data, user_id)
+        transcripts[i] = recognition.text
+        if subtitles is not None:
+            hypotheses[i] = recognition.hypotheses
+        finished[i] = True
+        done_ms += chunk.duration_ms
+        report_progress()
+        write_subtitles()
+        return recognition.text
+
+    # 1. Нарезаем файл за один проход ffmpeg; распознавание каждого фрагмента
+    # начинается сразу, не дожидаясь окончания декодирования
+    tasks = []
+    try:
+        async for chunk in chunk_source:
+            chunks.append(chunk)
+            transcripts.append("")
+            finished.append(False)
+            hypotheses.append(None)
+            tasks.append(asyncio.create_task(recognize_chunk(len(chunks) - 1)))
     except Exception as e:
-        logger.error(f"Ошибка при распознавании аудио: {e}")
+        logger.error(f"Ошибка при разделении аудио: {e}")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        remove_chunk_files(chunks)
         raise
 
-async def transcribe_audio(audio_path):
-    # 1. Сначала делим исходный файл на куски (wav)
-    chunks = await split_audio(audio_path)
-    transcripts = []
-    failed_chunks = []
-    
-    # Первый проход по всем фрагментам
-    for i, chunk_path in enumerate(chunks):
-        try:
-            # 2. Каждый кусок конвертируем в .pcm
-            prepared_audio = await prepare_audio(chunk_path)
-            transcript = transcribe_audio_chunk(prepared_audio)
-            transcripts.append(transcript)
-            os.remove(chunk_path)
-            os.remove(prepared_audio)
-        except Exception as e:
-            logger.error(f"Ошибка при распознавании фрагмента {i+1}/{len(chunks)} {chunk_path}: {e}")
-            failed_chunks.append((i, chunk_path))
-    
-    # Повторная попытка для неудачных фрагментов
+    # Повторы с паузами выполняет клиент Salute Speech; PCM фрагмента при этом
+    # перечитывается из файла задания и заново не конвертируется
     retry_errors = []
-    for i, chunk_path in failed_chunks:
-        try:
-            logger.info(f"Повторная попытка распознавания фрагмента {i+1}/{len(chunks)}")
-            prepared_audio = await prepare_audio(chunk_path)
-            transcript = transcribe_audio_chunk(prepared_audio)
-            # Вставляем в нужную позицию
-            while len(transcripts) <= i:
-                transcripts.append("")
-            transcripts[i] = transcript
-            os.remove(chunk_path)
-            os.remove(prepared_audio)
-        except Exception as e:
-            error_msg = f"Не удалось распознать фрагмент {i+1}/{len(chunks)} даже после повторной попытки: {e}"
-            logger.error(error_msg)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    remove_chunk_files(chunks)
+    write_subtitles(final=True)
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            error_msg = f"Не удалось распознать фрагмент {i+1}/{len(chunks)} даже после повторных попыток: {result}"
+            logger.error(f"{error_msg} (задание {job_name})")
             retry_errors.append(error_msg)
-            # Удаляем файлы
-            try:
-                os.remove(chunk_path)
-                if os.path.exists(prepared_audio):
-                    os.remove(prepared_audio)
-            except:
-                pass
-    
+
     full_transcript = " ".join(filter(None, transcripts))
-    
+
     # Если были ошибки после повторных попыток, добавляем информацию
     if retry_errors:
         full_transcript += "\n\n[Внимание: Некоторые части аудио не удалось распознать]"
-    
+
+    elapsed = time.monotonic() - started
+    audio_seconds = sum(chunk.duration_ms for chunk in chunks) / 1000
+    audio_seconds_total.inc(audio_seconds)
+    if elapsed > 0:
+        realtime_factor.observe(audio_seconds / elapsed)
+    logger.info(
+        f"Задание {job_name}: {len(chunks)} фрагментов распознано за {elapsed:.2f} с "
+        f"(параллельно: {recognition_scheduler.global_limit}, на пользователя: {recognition_scheduler.per_user_limit}); "
+        f"кэш: {transcript_cache.stats()}, повторы: {dict(salute_client.retry_counts)}"
+    )
     return full_transcript, retry_errors if retry_errors else None
 
+# Состояния асинхронной задачи Salute Speech для статусного сообщения
+ASYNC_STATUS_TEXT = {
+    "NEW": "в очереди Salute Speech",
+    "RUNNING": "идёт распознавание",
+    "DONE": "скачиваю результат",
+}
+
+async def transcribe_audio_async(audio_path, user_id=None, workspace=TEMP_DIR, duration=None, subtitles=None,
+                                 on_status=None):
+    started = time.monotonic()
+
+    def report_status(state):
+        # Асинхронная задача не отдаёт текст по частям, поэтому вместо него показываются состояние и прошедшее время
+        if on_status is None:
+            return
+        length = f" ({format_duration(duration)})" if duration else ""
+        elapsed = time.monotonic() - started
+        on_status(
+            f"Запись{length} распознаётся целиком: {ASYNC_STATUS_TEXT.get(state, state)}, "
+            f"прошло {format_duration(elapsed) if elapsed >= 60 else 'меньше минуты'}"
+        )
+
+    report_status("подготовка файла")
+    flac_path = await encode_for_upload(audio_path, workspace)
+    try:
+        # Файл загружается кусками из mmap, а не читается в память целиком
+        audio_content = FileSlice(flac_path)
+        cache_key = f"flac:{await asyncio.to_thread(sha256_hex, audio_content)}"
+        transcript = transcript_cache.get(cache_key)
+        hypotheses = None
+        if transcript is not None and subtitles is not None:
+            cached_hypotheses = transcript_cache.get(f"hypotheses:{cache_key}")
+            if cached_hypotheses is None:
+                # Запись распознавали только ради текста: без разметки времени распознаём её заново
+                transcript = None
+            else:
+                hypotheses = json.loads(cached_hypotheses)
+        if transcript is None:
+            with stage_seconds.time(stage="async_recognize"):
+                # Слот планировщика нужен только на загрузку и создание задачи: ожидание результата
+                # (до SALUTE_ASYNC_TIMEOUT) — лишь редкие опросы, и синхронные фрагменты в это время идут
+                async with recognition_scheduler.slot(user_id):
+                    report_status("загрузка файла")
+                    task_id = await salute_client.start_async(audio_content, sample_rate=PCM_SAMPLE_RATE)
+                recognition = await salute_client.finish_async(task_id, on_status=report_status)
+            transcript = recognition.text
+            hypotheses = recognition.hypotheses
+            transcript_cache.set(cache_key, transcript)
+            if subtitles is not None:
+                # Разметка фраз и слов в разы больше текста (у многочасовой записи — мегабайты),
+                # поэтому кэшируется только для заданий с субтитрами и не вытесняет тексты
+                transcript_cache.set(f"hypotheses:{cache_key}", json.dumps(hypotheses, ensure_ascii=False))
+        if subtitles is not None:
+            subtitles.add(hypothesis_segments(hypotheses, 0.0, duration))
+    finally:
+        os.remove(flac_path)
+    elapsed = time.monotonic() - started
+    if duration:
+        audio_seconds_total.inc(duration)
+        realtime_factor.observe(duration / elapsed)
+    logger.info(f"Задание {os.path.basename(audio_path)}: асинхронное распознавание за {elapsed:.2f} с")
+    return transcript, None
+
+async def transcribe_audio(audio_path, user_id=None, workspace=TEMP_DIR, duration=None, on_progress=None,
+                           subtitles=None, on_status=None):
+    # Длительность нужна и для выбора режима, и для процента в прогрессе
+    if duration is None:
+        duration = await probe_duration(audio_path)
+    # Длинные записи отправляются одной асинхронной задачей; если она не удалась,
+    # возвращаемся к синхронному распознаванию по фрагментам
+    if ASYNC_MIN_DURATION_S > 0 and duration is not None and duration >= ASYNC_MIN_DURATION_S:
+        try:
+            return await transcribe_audio_async(audio_path, user_id, workspace, duration, subtitles, on_status)
+        except Exception as e:
+            logger.warning(f"Асинхронное распознавание не удалось, перехожу на фрагменты: {e}")
+    return await transcribe_chunks(
+        iter_audio_chunks(audio_path, workspace), os.path.basename(audio_path), user_id,
+        total_duration_ms=int(duration * 1000) if duration else None, on_progress=on_progress,
+        subtitles=subtitles
+    )
+
+async def transcribe_audio_bytes(audio_data, user_id=None, duration=None, on_progress=None, subtitles=None):
+    return await transcribe_chunks(
+        iter_memory_chunks(audio_data), f"в памяти ({len(audio_data)} байт)", user_id,
+        total_duration_ms=int(duration * 1000) if duration else None, on_progress=on_progress,
+        subtitles=subtitles
+    )
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "Привет! Я бот для распознавания речи. Отправь мне аудиофайл, и я переведу его в текст."
@@ -200,141 +763,393 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
-        "Отправь мне аудиосообщение или аудиофайл, и я преобразую его в текст с помощью сервиса распознавания речи Salute от Сбера."
+        "Отправь мне аудиосообщение или аудиофайл, и я преобразую его в текст с помощью сервиса распознавания речи Salute от Сбера.\n\n"
+        "Команда /format srt (или vtt, json) добавляет к тексту файл с временными метками, /format text отключает его."
     )
 
+async def format_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    current = context.user_data.get("output_format", DEFAULT_OUTPUT_FORMAT)
+    if not context.args or context.args[0].lower() not in OUTPUT_FORMATS:
+        await update.message.reply_text(
+            f"Сейчас формат результата: {current}. Доступные форматы: {', '.join(OUTPUT_FORMATS)}.\n"
+            "Например: /format srt"
+        )
+        return
+    context.user_data["output_format"] = context.args[0].lower()
+    await update.message.reply_text(f"Формат результата: {context.user_data['output_format']}.")
+
 def is_audio_file(file_name):
     audio_extensions = ['.mp3', '.wav', '.ogg', '.m4a', '.flac', '.aac', '.wma']
     file_ext = os.path.splitext(file_name.lower())[1]
     return file_ext in audio_extensions
 
-async def handle_voice_or_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    message = await update.message.reply_text("Получил аудио. Начинаю обработку...")
-    try:
-        if update.message.voice:
-            file = await context.bot.get_file(update.message.voice.file_id)
-            file_ext = "ogg"
-        elif update.message.audio:
-            file = await context.bot.get_file(update.message.audio.file_id)
-            file_ext = os.path.splitext(update.message.audio.file_name)[1] if update.message.audio.file_name else "mp3"
-            file_ext = file_ext.lstrip(".")
+async def send_transcript(bot, chat_id, transcript, retry_errors):
+    if not transcript:
+        await bot.send_message(chat_id, "Не удалось распознать речь в аудиофайле.")
+        return
+    if len(transcript) <= 4000:
+        await bot.send_message(chat_id, transcript)
+    else:
+        await bot.send_document(
+            chat_id,
+            document=transcript.encode("utf-8"),
+            filename="transcript.txt",
+            caption="Текст распознавания слишком длинный, отправляю как файл."
+        )
+
+    # Если были ошибки, отправляем дополнительное сообщение
+    if retry_errors:
+        error_msg = "При распознавании возникли следующие проблемы:\n" + "\n".join(retry_errors)
+        if len(error_msg) <= 4000:
+            await bot.send_message(chat_id, error_msg)
         else:
-            await message.edit_text("Ошибка: не могу определить тип аудиофайла.")
-            return
-        file_path = os.path.join(TEMP_DIR, f"{uuid.uuid4()}.{file_ext}")
-        await file.download_to_drive(file_path)
-        await message.edit_text("Файл получен. Начинаю распознавание...")
+            await bot.send_document(
+                chat_id,
+                document=error_msg.encode("utf-8"),
+                filename="errors.txt",
+                caption="Подробная информация об ошибках при распознавании."
+            )
+
+async def process_job(bot, job):
+    # Выполняется в процессе-обработчике очереди (job_worker.py). Возвращает
+    # (текст, ошибки фрагментов, ошибка для пользователя, субтитры) для JobQueue.complete
+    status = functools.partial(bot.edit_message_text, chat_id=job["chat_id"], message_id=job["status_message_id"])
+    # Промежуточный текст по мере готовности фрагментов показывается в статусном сообщении
+    progress = ProgressReporter(status, PROGRESS_UPDATE_INTERVAL)
+    # У документов Telegram не сообщает длительность, её определит transcribe_audio
+    duration = job["duration"]
+    in_memory = (
+        job["file_size"] is not None and job["file_size"] <= IN_MEMORY_MAX_BYTES
+        and job["file_ext"].lower() not in PIPE_UNSAFE_FORMATS
+        and not (ASYNC_MIN_DURATION_S > 0 and duration is not None and duration >= ASYNC_MIN_DURATION_S)
+    )
+    reserved = 0
+    if in_memory:
+        # Исходник плюс декодированный PCM; без длительности считаем по худшему сжатию речевых кодеков
+        pcm_estimate = duration * PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH if duration else job["file_size"] * 16
+        reserved = job["file_size"] + int(pcm_estimate)
+        if reserved > JOB_MEMORY_BUDGET_MB * 1024 * 1024 or not memory_budget.try_reserve(reserved):
+            # Память занята другими заданиями: этот файл пойдёт через диск, а не будет ждать
+            in_memory = False
+            reserved = 0
+    subtitles = None
+    if job["output_format"] in SUBTITLE_FORMATS:
+        # Субтитры пишутся в файл по мере готовности фрагментов и в память не собираются: бот отправит
+        # этот же файл. Пока задание не готово, файл лежит под временным именем
+        subtitles_path = os.path.join(SUBTITLES_DIR, f"job{job['id']}.{job['output_format']}")
+        subtitles_file = open(f"{subtitles_path}.part", "w", encoding="utf-8")
+        subtitles = SubtitleWriter(subtitles_file, job["output_format"])
+    try:
+        transcript, retry_errors, error = await _process_job(
+            bot, job, progress, duration, in_memory, subtitles
+        )
+        if subtitles is None or error or not subtitles.count:
+            return transcript, retry_errors, error, None
+        subtitles.close()
+        subtitles_file.close()
+        os.replace(subtitles_file.name, subtitles_path)
+        return transcript, retry_errors, error, subtitles_path
+    finally:
+        if reserved:
+            memory_budget.release(reserved)
+        if subtitles is not None:
+            subtitles_file.close()
+            if os.path.exists(subtitles_file.name):
+                os.remove(subtitles_file.name)
+
+async def _process_job(bot, job, progress, duration, in_memory, subtitles=None):
+    with nullcontext() if in_memory else job_workspace() as workspace:
         try:
-            transcript, retry_errors = await transcribe_audio(file_path)
-            os.remove(file_path)
-            # Отправляем результат
-            if transcript:
-                if len(transcript) <= 4000:
-                    await update.message.reply_text(transcript)
+            with stage_seconds.time(stage="download"):
+                file = await bot.get_file(job["file_id"])
+                if in_memory:
+                    # Короткие голосовые: без download_to_drive и промежуточных .pcm на диске
+                    audio_data = bytes(await file.download_as_bytearray())
                 else:
-                    transcript_file = os.path.join(TEMP_DIR, f"transcript_{uuid.uuid4()}.txt")
-                    with open(transcript_file, "w", encoding="utf-8") as f:
-                        f.write(transcript)
-                    await update.message.reply_document(
-                        document=open(transcript_file, "rb"), 
-                        filename="transcript.txt",
-                        caption="Текст распознавания слишком длинный, отправляю как файл."
-                    )
-                    os.remove(transcript_file)
-                
-                # Если были ошибки, отправляем дополнительное сообщение
-                if retry_errors:
-                    error_msg = "При распознавании возникли следующие проблемы:\n" + "\n".join(retry_errors)
-                    if len(error_msg) <= 4000:
-                        await update.message.reply_text(error_msg)
-                    else:
-                        error_file = os.path.join(TEMP_DIR, f"errors_{uuid.uuid4()}.txt")
-                        with open(error_file, "w", encoding="utf-8") as f:
-                            f.write(error_msg)
-                        await update.message.reply_document(
-                            document=open(error_file, "rb"),
-                            filename="errors.txt",
-                            caption="Подробная информация об ошибках при распознавании."
-                        )
-                        os.remove(error_file)
+                    file_path = os.path.join(workspace, f"source.{job['file_ext']}")
+                    await file.download_to_drive(file_path)
+            audio_bytes_total.inc(len(audio_data) if in_memory else os.path.getsize(file_path))
+        except Exception as e:
+            error_message = str(e)
+            logger.error(f"Ошибка при получении файла: {error_message}")
+            await progress.finish("Не удалось получить файл.")
+            if "File is too big" in error_message:
+                return None, None, "Ошибка: аудиофайл слишком большой. Telegram ограничивает размер файлов до 20 МБ. Пожалуйста, отправьте файл меньшего размера или разбейте аудио на части."
+            return None, None, f"Произошла ошибка при получении файла: {error_message}"
+        # Через ProgressReporter, а не edit_message_text: у задания, выданного заново после сбоя обработчика,
+        # сообщение уже может содержать этот текст, и ответ Telegram "message is not modified" не должен его ронять
+        progress.show("Файл получен. Начинаю распознавание...")
+        try:
+            if in_memory:
+                transcript, retry_errors = await transcribe_audio_bytes(
+                    audio_data, user_id=job["user_id"], duration=duration, on_progress=progress.update,
+                    subtitles=subtitles
+                )
             else:
-                await update.message.reply_text("Не удалось распознать речь в аудиофайле.")
-            clear_temp_dir()
+                transcript, retry_errors = await transcribe_audio(
+                    file_path, user_id=job["user_id"], workspace=workspace, duration=duration,
+                    on_progress=progress.update, subtitles=subtitles, on_status=progress.show
+                )
         except Exception as e:
             logger.error(f"Ошибка при обработке аудио: {e}")
-            await update.message.reply_text(f"Произошла ошибка при обработке аудио: {str(e)}")
-            clear_temp_dir()
-    except Exception as e:
-        error_message = str(e)
-        logger.error(f"Ошибка при получении файла: {error_message}")
-        if "File is too big" in error_message:
-            await message.edit_text("Ошибка: аудиофайл слишком большой. Telegram ограничивает размер файлов до 20 МБ. Пожалуйста, отправьте файл меньшего размера или разбейте аудио на части.")
-        else:
-            await message.edit_text(f"Произошла ошибка при получении файла: {error_message}")
+            await progress.finish("Распознавание прервано из-за ошибки.")
+            return None, None, f"Произошла ошибка при обработке аудио: {str(e)}"
+    await progress.finish("Распознавание завершено.")
+    if transcript and not retry_errors:
+        transcript_cache.set(f"file:{job['file_unique_id']}", transcript)
+    return transcript, retry_errors, None
+
+async def deliver_results(bot):
+    # Готовые результаты отправляет процесс бота: обработчики только пишут их в очередь
+    while True:
+        for job in job_queue.finished():
+            trace = tracing.set_trace_id(f"job{job['id']}")
+            try:
+                with stage_seconds.time(stage="deliver"):
+                    if job["error"]:
+                        await bot.send_message(job["chat_id"], job["error"])
+                    else:
+                        # Текст и субтитры — отдельные отправки: при повторе после сбоя на субтитрах
+                        # текст второй раз не приходит
+                        if not job["transcript_sent"]:
+                            await send_transcript(bot, job["chat_id"], job["transcript"], job["errors"])
+                            job_queue.mark_transcript_sent(job["id"])
+                        if job["subtitles_path"]:
+                            # python-telegram-bot читает документ целиком при отправке; размер ограничен
+                            # лимитом Telegram на файлы от бота (50 МБ), это многие часы субтитров
+                            with open(job["subtitles_path"], "rb") as document:
+                                await bot.send_document(
+                                    job["chat_id"],
+                                    document=document,
+                                    filename=f"transcript.{job['output_format']}",
+                                    caption="Текст с временными метками."
+                                )
+            except RetryAfter as e:
+                logger.warning(f"Telegram ограничил частоту отправки, жду {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+                break
+            except (BadRequest, Forbidden) as e:
+                # Повтор не поможет: чат удалён, бот заблокирован или сообщение отклонено
+                logger.error(f"Не удалось доставить результат задания {job['id']}: {e}")
+            except TelegramError as e:
+                # Таймаут или сетевой сбой: результат уже сохранён в очереди, задание откладывается
+                # с растущей паузой, а остальные доставляются, не дожидаясь его
+                attempts = job["delivery_attempts"] + 1
+                if attempts < JOB_DELIVERY_ATTEMPTS:
+                    delay = min(JOB_DELIVERY_INTERVAL * 2 ** attempts, JOB_DELIVERY_MAX_DELAY)
+                    logger.warning(
+                        f"Не удалось доставить результат задания {job['id']} (попытка {attempts}), "
+                        f"повторю через {delay:.0f} с: {e}"
+                    )
+                    job_queue.postpone_delivery(job["id"], delay)
+                    continue
+                logger.error(f"Не удалось доставить результат задания {job['id']} за {attempts} попыток: {e}")
+            except Exception as e:
+                logger.error(f"Не удалось доставить результат задания {job['id']}: {e}")
+            finally:
+                tracing.trace_id.reset(trace)
+            job_queue.mark_delivered(job["id"])
+            if job["subtitles_path"] and os.path.exists(job["subtitles_path"]):
+                os.remove(job["subtitles_path"])
+        await asyncio.sleep(JOB_DELIVERY_INTERVAL)
+
+def estimate_job_cost(duration, file_size):
+    # Стоимость задания в секундах аудио — до скачивания, по данным Telegram
+    if duration:
+        return float(duration)
+    return (file_size or 0) / ESTIMATE_BYTES_PER_SECOND
+
+def format_duration(seconds):
+    minutes = int(seconds) // 60
+    if minutes < 60:
+        return f"{max(minutes, 1)} мин"
+    return f"{minutes // 60} ч {minutes % 60} мин"
+
+def admission_error(user_id, cost, priority):
+    # Причина отказа в приёме задания: (метка для метрики, текст для пользователя) или None
+    if MAX_JOB_DURATION and cost > MAX_JOB_DURATION:
+        return "too_long", (
+            f"Запись слишком длинная: примерно {format_duration(cost)}, "
+            f"а принимаются записи до {format_duration(MAX_JOB_DURATION)}. Разбейте её на части."
+        )
+    if MAX_QUEUED_PER_USER:
+        user_jobs, _ = job_queue.pending(user_id)
+        if user_jobs >= MAX_QUEUED_PER_USER:
+            return "user_limit", (
+                f"У вас уже {user_jobs} файлов в очереди. Дождитесь их распознавания и отправьте этот файл снова."
+            )
+    if MAX_QUEUE_DURATION and not priority:
+        _, queued_cost = job_queue.pending()
+        if queued_cost + cost > MAX_QUEUE_DURATION:
+            return "overloaded", (
+                "Сейчас очередь на распознавание переполнена. Короткие голосовые принимаются как обычно, "
+                "а этот файл отправьте, пожалуйста, немного позже."
+            )
+    return None
+
+def queue_status_text(position):
+    if position <= 1:
+        return "Файл поставлен в очередь на распознавание, он следующий."
+    return f"Файл поставлен в очередь на распознавание, место в очереди: {position}."
+
+async def report_queue_positions(bot):
+    # Место в очереди меняется по мере выдачи заданий: обновляем статусные сообщения, когда оно сдвинулось
+    reported = {}
+    while True:
+        await asyncio.sleep(QUEUE_POSITION_INTERVAL)
+        jobs = job_queue.queued()
+        reported = {job["id"]: reported[job["id"]] for job in jobs if job["id"] in reported}
+        for position, job in enumerate(jobs, start=1):
+            if reported.get(job["id"]) == position:
+                continue
+            reported[job["id"]] = position
+            try:
+                await bot.edit_message_text(
+                    queue_status_text(position), chat_id=job["chat_id"], message_id=job["status_message_id"]
+                )
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                break
+            except Exception as e:
+                logger.debug(f"Не удалось обновить место в очереди задания {job['id']}: {e}")
+
+async def enqueue_audio(update: Update, context: ContextTypes.DEFAULT_TYPE, message, attachment, file_ext):
+    output_format = context.user_data.get("output_format", DEFAULT_OUTPUT_FORMAT)
+    # Пересланный повторно файл сохраняет file_unique_id: отвечаем из кэша, даже не скачивая его.
+    # В кэше только текст, поэтому за субтитрами задание всё же ставится в очередь (фрагменты возьмутся из кэша)
+    cached_transcript = transcript_cache.get(f"file:{attachment.file_unique_id}") if output_format == "text" else None
+    if cached_transcript is not None:
+        logger.info(f"Текст для {attachment.file_unique_id} найден в кэше")
+        await message.edit_text("Этот файл уже распознавался, отправляю сохранённый текст.")
+        await send_transcript(context.bot, update.effective_chat.id, cached_transcript, None)
+        return
+    duration = getattr(attachment, "duration", None)
+    cost = estimate_job_cost(duration, attachment.file_size)
+    priority = int(cost <= PRIORITY_MAX_DURATION)
+    rejection = admission_error(update.effective_user.id, cost, priority)
+    if rejection is not None:
+        reason, text = rejection
+        jobs_rejected_total.inc(reason=reason)
+        logger.info(f"Файл пользователя {update.effective_user.id} не принят ({reason}), оценка {cost:.0f} с")
+        await message.edit_text(text)
+        return
+    job_id = job_queue.enqueue(
+        chat_id=update.effective_chat.id,
+        user_id=update.effective_user.id,
+        message_id=update.message.message_id,
+        status_message_id=message.message_id,
+        file_id=attachment.file_id,
+        file_unique_id=attachment.file_unique_id,
+        file_ext=file_ext,
+        file_size=attachment.file_size,
+        duration=duration,
+        cost=cost,
+        priority=priority,
+        output_format=output_format,
+    )
+    trace = tracing.set_trace_id(f"job{job_id}")
+    logger.info(
+        f"Задание {job_id} от пользователя {update.effective_user.id} поставлено в очередь: "
+        f"оценка {cost:.0f} с, приоритет {priority}"
+    )
+    tracing.trace_id.reset(trace)
+    await message.edit_text(queue_status_text(job_queue.position({"id": job_id, "priority": priority})))
+
+async def handle_voice_or_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = await update.message.reply_text("Получил аудио. Начинаю обработку...")
+    if update.message.voice:
+        attachment = update.message.voice
+        file_ext = "ogg"
+    elif update.message.audio:
+        attachment = update.message.audio
+        file_ext = os.path.splitext(update.message.audio.file_name)[1] if update.message.audio.file_name else "mp3"
+        file_ext = file_ext.lstrip(".")
+    else:
+        await message.edit_text("Ошибка: не могу определить тип аудиофайла.")
+        return
+    await enqueue_audio(update, context, message, attachment, file_ext)
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message.document.file_name or not is_audio_file(update.message.document.file_name):
         await update.message.reply_text("Этот документ не является аудиофайлом. Пожалуйста, отправьте аудиофайл.")
         return
     message = await update.message.reply_text("Получил аудиофайл. Начинаю обработку...")
-    try:
-        file = await context.bot.get_file(update.message.document.file_id)
-        file_ext = os.path.splitext(update.message.document.file_name)[1]
-        file_ext = file_ext.lstrip(".")
-        file_path = os.path.join(TEMP_DIR, f"{uuid.uuid4()}.{file_ext}")
-        await file.download_to_drive(file_path)
-        await message.edit_text("Файл получен. Начинаю распознавание...")
-        try:
-            transcript, retry_errors = await transcribe_audio(file_path)
-            os.remove(file_path)
-            if transcript:
-                if len(transcript) <= 4000:
-                    await update.message.reply_text(transcript)
-                else:
-                    transcript_file = os.path.join(TEMP_DIR, f"transcript_{uuid.uuid4()}.txt")
-                    with open(transcript_file, "w", encoding="utf-8") as f:
-                        f.write(transcript)
-                    await update.message.reply_document(
-                        document=open(transcript_file, "rb"), 
-                        filename="transcript.txt",
-                        caption="Текст распознавания слишком длинный, отправляю как файл."
-                    )
-                    os.remove(transcript_file)
-                
-                # Если были ошибки, отправляем дополнительное сообщение
-                if retry_errors:
-                    error_msg = "При распознавании возникли следующие проблемы:\n" + "\n".join(retry_errors)
-                    if len(error_msg) <= 4000:
-                        await update.message.reply_text(error_msg)
-                    else:
-                        error_file = os.path.join(TEMP_DIR, f"errors_{uuid.uuid4()}.txt")
-                        with open(error_file, "w", encoding="utf-8") as f:
-                            f.write(error_msg)
-                        await update.message.reply_document(
-                            document=open(error_file, "rb"),
-                            filename="errors.txt",
-                            caption="Подробная информация об ошибках при распознавании."
-                        )
-                        os.remove(error_file)
-            else:
-                await update.message.reply_text("Не удалось распознать речь в аудиофайле.")
-            clear_temp_dir()
-        except Exception as e:
-            logger.error(f"Ошибка при обработке аудио: {e}")
-            await update.message.reply_text(f"Произошла ошибка при обработке аудио: {str(e)}")
-            clear_temp_dir()
-    except Exception as e:
-        error_message = str(e)
-        logger.error(f"Ошибка при получении файла: {error_message}")
-        if "File is too big" in error_message:
-            await message.edit_text("Ошибка: аудиофайл слишком большой. Telegram ограничивает размер файлов до 20 МБ. Пожалуйста, отправьте файл меньшего размера или разбейте аудио на части.")
-        else:
-            await message.edit_text(f"Произошла ошибка при получении файла: {error_message}")
+    file_ext = os.path.splitext(update.message.document.file_name)[1].lstrip(".")
+    await enqueue_audio(update, context, message, update.message.document, file_ext)
+
+async def start_background_tasks(application: Application):
+    # Метрики и /ready поднимаются первыми: пока идёт прогрев, /ready отвечает 503
+    if METRICS_PORT:
+        application.bot_data["metrics_server"] = await start_http_server(
+            metrics, METRICS_PORT, METRICS_HOST, ready=startup.is_ready
+        )
+    # Процесс бота сам не распознаёт, ему нужен только ffmpeg на этой машине и прогретые обработчики.
+    # post_init выполняется до запуска вебхука и опроса, поэтому обновления начинают приходить,
+    # когда обработчики готовы (или истёк STARTUP_WARMUP_TIMEOUT)
+    ffmpeg_ok = await verify_ffmpeg()
+    worker_processes = application.bot_data.get("worker_processes", [])
+    workers_ready = application.bot_data.get("workers_ready", [])
+    # Событие готовности остаётся выставленным и после смерти процесса, поэтому проверяется и он сам
+    startup.wait_for(lambda: all(
+        process.is_alive() and event.is_set() for process, event in zip(worker_processes, workers_ready)
+    ))
+    with startup.phase("workers"):
+        deadline = time.monotonic() + STARTUP_WARMUP_TIMEOUT
+        for event in workers_ready:
+            await asyncio.to_thread(event.wait, max(0.0, deadline - time.monotonic()))
+    startup.ready = ffmpeg_ok
+    if startup.is_ready():
+        logger.info(f"Бот готов за {time.monotonic() - startup.started:.2f} с: {startup.summary()}")
+    else:
+        logger.warning(f"Бот запускается без полного прогрева: {startup.summary()}")
+    application.bot_data["background_tasks"] = [
+        asyncio.create_task(temp_janitor()),
+        asyncio.create_task(deliver_results(application.bot)),
+        asyncio.create_task(report_queue_positions(application.bot)),
+        asyncio.create_task(loop_lag.run()),
+    ]
+    if worker_processes:
+        from job_worker import supervise_workers
+        application.bot_data["background_tasks"].append(asyncio.create_task(
+            supervise_workers(worker_processes, workers_ready, JOB_WORKER_CONCURRENCY, WORKER_CHECK_INTERVAL)
+        ))
+
+async def stop_background_tasks(application: Application):
+    for task in application.bot_data.pop("background_tasks", []):
+        task.cancel()
+    metrics_server = application.bot_data.pop("metrics_server", None)
+    if metrics_server is not None:
+        metrics_server.close()
+    # Обработчики сами возвращают незаконченные задания в очередь при SIGTERM
+    processes = application.bot_data.pop("worker_processes", [])
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+    await salute_client.close()
+    transcript_cache.close()
+    job_queue.close()
+    cpu_pool.close()
 
 def main():
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        .post_init(start_background_tasks)
+        .post_shutdown(stop_background_tasks)
+        .build()
+    )
+    if JOB_WORKERS > 0:
+        from job_worker import start_workers
+        # Обработчики прогреваются, пока бот подключается к Telegram
+        application.bot_data["worker_processes"], application.bot_data["workers_ready"] = start_workers(
+            JOB_WORKERS, JOB_WORKER_CONCURRENCY
+        )
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("format", format_command))
     application.add_handler(MessageHandler(filters.VOICE | filters.AUDIO, handle_voice_or_audio))
     application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
     if SERVER_URL:
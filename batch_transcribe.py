@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Пакетное распознавание каталога или списка аудиофайлов без Telegram
+
+Файлы распознаются тем же конвейером, что и в боте (transcribe_audio),
+по несколько одновременно. Каждый результат сразу дописывается строкой в
+JSONL-файл, который служит и контрольной точкой: при повторном запуске
+файлы, уже распознанные без ошибок, пропускаются по SHA-256 содержимого,
+поэтому переименованные и повторяющиеся в архиве файлы не распознаются
+заново. С --txt-dir тексты дополнительно пишутся по файлу на запись,
+с --subtitles рядом с ними — субтитры SRT/VTT или JSON с метками времени.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import shutil
+import hashlib
+import argparse
+import logging
+
+import audio_transcription_bot as core
+from subtitles import FORMATS as SUBTITLE_FORMATS, SubtitleWriter
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(path):
+    # Строка манифеста — путь к файлу или JSON-объект с полем "path"; пути считаются от каталога манифеста
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                line = json.loads(line)["path"]
+            yield os.path.join(base, line)
+
+
+def list_inputs(source):
+    # Возвращает (корень, файлы); от корня строятся имена TXT-файлов в --txt-dir
+    if os.path.isdir(source):
+        files = []
+        for directory, _, names in os.walk(source):
+            files.extend(os.path.join(directory, name) for name in names if core.is_audio_file(name))
+        return os.path.abspath(source), sorted(os.path.abspath(path) for path in files)
+    files = [os.path.abspath(path) for path in read_manifest(source)]
+    if not files:
+        return os.getcwd(), []
+    root = os.path.commonpath([os.path.dirname(path) for path in files])
+    return root, files
+
+
+def load_checkpoint(path):
+    # Последняя запись по хэшу побеждает: неудачные попытки перезаписываются успешными
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as results:
+        for line in results:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Строка, оборванная при аварийной остановке
+                continue
+            if record.get("status") in ("ok", "duplicate"):
+                done[record["sha256"]] = record.get("duplicate_of") or record["path"]
+            else:
+                done.pop(record.get("sha256"), None)
+    return done
+
+
+class BatchRun:
+    """Состояние одного прогона: счётчики, уже готовые хэши и открытый файл результатов"""
+
+    def __init__(self, files, root, output, txt_dir, done, subtitle_format=None):
+        self.files = files
+        self.root = root
+        self.output = output
+        self.txt_dir = txt_dir
+        self.subtitle_format = subtitle_format
+        # sha256 → путь файла, распознанного под этим хэшем (в прошлых прогонах или в этом)
+        self.done = done
+        # Хэши, которые распознаются прямо сейчас: повтор того же содержимого ждёт первый файл
+        self.in_progress = {}
+        self.started = time.monotonic()
+        self.finished = 0
+        self.skipped = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+
+    def txt_path(self, path, extension="txt"):
+        return os.path.join(self.txt_dir, f"{os.path.relpath(path, self.root)}.{extension}")
+
+    def write(self, record, transcript=None):
+        self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # Запись должна пережить аварийную остановку, иначе файл распознается заново
+        self.output.flush()
+        os.fsync(self.output.fileno())
+        if self.txt_dir and transcript is not None:
+            txt_path = self.txt_path(record["path"])
+            os.makedirs(os.path.dirname(txt_path), exist_ok=True)
+            with open(txt_path, "w", encoding="utf-8") as txt:
+                txt.write(transcript)
+
+    def copy_duplicate(self, path, sha256):
+        original = self.done[sha256]
+        record = {"path": path, "sha256": sha256, "status": "duplicate", "duplicate_of": original}
+        transcript = None
+        if self.txt_dir and os.path.exists(self.txt_path(original)):
+            with open(self.txt_path(original), encoding="utf-8") as txt:
+                transcript = txt.read()
+        if self.subtitle_format and os.path.exists(self.txt_path(original, self.subtitle_format)):
+            shutil.copyfile(
+                self.txt_path(original, self.subtitle_format), self.subtitle_path(path)
+            )
+        self.write(record, transcript)
+
+    def subtitle_path(self, path):
+        subtitle_path = self.txt_path(path, self.subtitle_format)
+        os.makedirs(os.path.dirname(subtitle_path), exist_ok=True)
+        return subtitle_path
+
+    async def process(self, index, path):
+        sha256 = await asyncio.to_thread(file_sha256, path)
+        while sha256 in self.in_progress:
+            await self.in_progress[sha256].wait()
+        if sha256 in self.done:
+            if self.done[sha256] != path:
+                self.copy_duplicate(path, sha256)
+            self.skipped += 1
+            return
+        self.in_progress[sha256] = asyncio.Event()
+        started = time.monotonic()
+        record = {"path": path, "sha256": sha256}
+        transcript = None
+        try:
+            duration = await core.probe_duration(path)
+            record["duration"] = duration
+            with core.job_workspace() as workspace:
+                subtitles = None
+                if self.subtitle_format:
+                    # Субтитры пишутся прямо в файл по мере готовности фрагментов и переименовываются в конце,
+                    # чтобы после остановки не осталось недописанного файла под настоящим именем
+                    subtitle_file = open(os.path.join(workspace, "subtitles"), "w", encoding="utf-8")
+                    subtitles = SubtitleWriter(subtitle_file, self.subtitle_format)
+                try:
+                    # Свой user_id на файл: лимит на пользователя в планировщике не сводит прогон к одному файлу
+                    transcript, errors = await core.transcribe_audio(
+                        path, user_id=f"batch{index}", workspace=workspace, duration=duration, subtitles=subtitles
+                    )
+                finally:
+                    if subtitles is not None:
+                        subtitles.close()
+                        subtitle_file.close()
+                if subtitles is not None:
+                    shutil.move(subtitle_file.name, self.subtitle_path(path))
+            record.update(status="partial" if errors else "ok", transcript=transcript, errors=errors)
+            if errors:
+                self.failed += 1
+            else:
+                self.done[sha256] = path
+            self.audio_seconds += duration or 0
+        except Exception as e:
+            logger.error(f"Не удалось распознать {path}: {e}")
+            record.update(status="error", error=str(e))
+            self.failed += 1
+        finally:
+            self.in_progress.pop(sha256).set()
+        record["elapsed_s"] = round(time.monotonic() - started, 3)
+        self.write(record, transcript)
+        self.finished += 1
+
+    def progress_line(self):
+        elapsed = time.monotonic() - self.started
+        handled = self.finished + self.skipped
+        line = (
+            f"Готово {handled}/{len(self.files)} (пропущено {self.skipped}, с ошибками {self.failed}), "
+            f"аудио {self.audio_seconds / 3600:.2f} ч за {elapsed:.0f} с"
+        )
+        if elapsed > 0 and self.audio_seconds:
+            line += f", {self.audio_seconds / elapsed:.1f} с аудио/с"
+        if self.finished and handled < len(self.files):
+            # Пропущенные файлы почти ничего не стоят, поэтому оценка только по распознанным
+            remaining = (len(self.files) - handled) * elapsed / self.finished
+            line += f", осталось ~{core.format_duration(remaining)}"
+        return line
+
+
+async def report_progress(run, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(run.progress_line(), flush=True)
+
+
+async def run_batch(args):
+    root, files = list_inputs(args.source)
+    done = load_checkpoint(args.output)
+    print(f"Файлов: {len(files)}, уже распознано по контрольной точке: {len(done)}", flush=True)
+    # Ошибки попадают в лог и без этого; построчный лог фрагментов и HTTP-запросов при пакетной работе только мешает
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    pending = iter(enumerate(files))
+    # Токен, соединения и пул процессов готовятся до первого файла; если не вышло, файлы всё равно
+    # распознаются, клиент получит токен сам
+    await core.warm_up()
+
+    async def worker():
+        for index, path in pending:
+            await run.process(index, path)
+
+    with open(args.output, "a", encoding="utf-8") as output:
+        run = BatchRun(files, root, output, args.txt_dir, done, args.subtitles)
+        reporter = asyncio.create_task(report_progress(run, args.progress_interval))
+        # Бот, запущенный с тем же TEMP_DIR, не должен принять долгие каталоги прогона за брошенные
+        workspace_toucher = asyncio.create_task(core.touch_workspaces())
+        try:
+            # Общий итератор вместо задачи на файл: в памяти не больше --jobs заданий даже для огромных архивов
+            await asyncio.gather(*(worker() for _ in range(args.jobs)))
+        finally:
+            reporter.cancel()
+            workspace_toucher.cancel()
+            await core.salute_client.close()
+            core.transcript_cache.close()
+            core.cpu_pool.close()
+            print(run.progress_line(), flush=True)
+    return run
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетное распознавание аудиофайлов через Salute Speech")
+    parser.add_argument("source", help="каталог с аудио или манифест: по пути (или JSON с полем path) в строке")
+    parser.add_argument("--output", default="transcripts.jsonl", help="JSONL с результатами, он же контрольная точка")
+    parser.add_argument("--txt-dir", help="каталог для текстов по файлу на запись")
+    parser.add_argument("--subtitles", choices=SUBTITLE_FORMATS, help="субтитры рядом с текстами (нужен --txt-dir)")
+    parser.add_argument("--jobs", type=int, default=4, help="файлов одновременно")
+    parser.add_argument("--progress-interval", type=float, default=10, help="как часто печатать прогресс, с")
+    parser.add_argument("--verbose", action="store_true", help="подробный лог распознавания")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.subtitles and not args.txt_dir:
+        print("--subtitles пишет файлы рядом с текстами, укажите --txt-dir")
+        sys.exit(2)
+    try:
+        run = asyncio.run(run_batch(args))
+    except KeyboardInterrupt:
+        print(f"Остановлено; продолжить можно той же командой, готовые файлы записаны в {args.output}")
+        sys.exit(130)
+    sys.exit(1 if run.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Нагрузочный замер распознавания против локального mock_server.py
+
+Для каждой длины аудио и уровня параллельности запускает задания
+transcribe_audio в отдельном процессе (чтобы пиковая память считалась по
+сценарию, а не накапливалась) и пишет пропускную способность, задержки
+p50/p95/p99 и пиковый RSS в JSON. С --baseline сравнивает результат с
+прошлым прогоном и завершается с кодом 1 при регрессии.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import resource
+import subprocess
+import multiprocessing
+
+
+def percentile(values, q):
+    # Ближайший ранг: на десятках замеров интерполяция ничего не добавляет
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+def generate_audio(ffmpeg_bin, path, seconds):
+    # «Речь»: 5 с тона с гармониками и 2 с тишины, чтобы нарезка находила паузы как на живой записи
+    expression = "0.4*sin(2*PI*220*t)*(0.6+0.4*sin(2*PI*3*t))*lt(mod(t\\,7)\\,5)"
+    command = [
+        ffmpeg_bin, "-v", "error", "-y", "-f", "lavfi", "-i", f"aevalsrc={expression}:s=48000:d={seconds}",
+        "-ac", "1", "-c:a", "libopus", "-b:a", "32k", path
+    ]
+    subprocess.run(command, check=True)
+
+
+def wait_for_port(host, port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"mock_server не запустился на {host}:{port}")
+
+
+async def run_jobs(audio_path, duration, concurrency, jobs):
+    import audio_transcription_bot as core
+
+    latencies = []
+    failed = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def job(i):
+        nonlocal failed
+        async with slots:
+            started = time.monotonic()
+            try:
+                with core.job_workspace() as workspace:
+                    # Каждое задание от своего пользователя, как разные чаты в боте
+                    _, errors = await core.transcribe_audio(audio_path, user_id=i, workspace=workspace, duration=duration)
+                if errors:
+                    failed += 1
+            except Exception:
+                failed += 1
+            latencies.append(time.monotonic() - started)
+
+    await core.get_salute_token()
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*(job(i) for i in range(jobs)))
+    finally:
+        wall = time.monotonic() - started
+        await core.salute_client.close()
+        core.cpu_pool.close()
+    return {
+        "wall_s": wall,
+        "latencies": latencies,
+        "failed": failed,
+        "requests": dict(core.salute_client.request_counts),
+        "retries": dict(core.salute_client.retry_counts),
+    }
+
+
+def run_scenario(env, audio_path, duration, concurrency, jobs, queue):
+    # Отдельный процесс на сценарий: настройки бота читаются из окружения при импорте
+    os.environ.update(env)
+    result = asyncio.run(run_jobs(audio_path, duration, concurrency, jobs))
+    # ru_maxrss в Linux указывается в килобайтах
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put(result)
+
+
+def summarize(duration, concurrency, jobs, raw):
+    latencies = raw["latencies"]
+    return {
+        "audio_seconds": duration,
+        "concurrency": concurrency,
+        "jobs": jobs,
+        "failed": raw["failed"],
+        "wall_s": round(raw["wall_s"], 3),
+        "jobs_per_s": round(jobs / raw["wall_s"], 3),
+        "audio_seconds_per_s": round(duration * jobs / raw["wall_s"], 2),
+        "latency_s": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(max(latencies), 3),
+        },
+        "peak_rss_mb": round(raw["peak_rss_mb"], 1),
+        "requests": raw["requests"],
+        "retries": raw["retries"],
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Регрессия: p95 вырос или пропускная способность упала больше чем на tolerance
+    previous = {(s["audio_seconds"], s["concurrency"]): s for s in baseline["scenarios"]}
+    regressions = []
+    for scenario in results["scenarios"]:
+        old = previous.get((scenario["audio_seconds"], scenario["concurrency"]))
+        if old is None:
+            continue
+        name = f"{scenario['audio_seconds']} с × {scenario['concurrency']}"
+        if scenario["latency_s"]["p95"] > old["latency_s"]["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old['latency_s']['p95']} → {scenario['latency_s']['p95']} с")
+        if scenario["audio_seconds_per_s"] < old["audio_seconds_per_s"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: пропускная способность {old['audio_seconds_per_s']} → {scenario['audio_seconds_per_s']} с/с"
+            )
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный замер распознавания против mock_server.py")
+    parser.add_argument("--lengths", default="30,120,600", help="длины аудио через запятую, с")
+    parser.add_argument("--concurrency", default="1,4,16", help="уровни параллельности через запятую")
+    parser.add_argument("--jobs", type=int, default=0, help="заданий на сценарий (по умолчанию 2 × параллельность)")
+    parser.add_argument("--port", type=int, default=18089)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--latency-per-second", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    lengths = [int(value) for value in args.lengths.split(",")]
+    levels = [int(value) for value in args.concurrency.split(",")]
+    workdir = os.path.join(os.getcwd(), "temp", "bench_load")
+    os.makedirs(workdir, exist_ok=True)
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = {
+        "SALUTE_OAUTH_URL": f"{base_url}/api/v2/oauth",
+        "SALUTE_API_URL": f"{base_url}/rest/v1",
+        "SALUTE_SPEECH_API_KEY": os.getenv("SALUTE_SPEECH_API_KEY") or "mock",
+        # Кэш отключён, иначе одинаковые файлы распознавались бы один раз
+        "TRANSCRIPT_CACHE_PATH": "",
+        "METRICS_PORT": "0",
+    }
+    ffmpeg_bin = "ffmpeg" if os.name != "nt" else os.path.join(os.getcwd(), "ffmpeg", "bin", "ffmpeg.exe")
+
+    mock = subprocess.Popen([
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_server.py"),
+        "--port", str(args.port), "--latency", str(args.latency),
+        "--latency-per-second", str(args.latency_per_second),
+        "--error-rate", str(args.error_rate), "--rate-limit", str(args.rate_limit),
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    context = multiprocessing.get_context("spawn")
+    results = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "mock": {
+            "latency": args.latency, "latency_per_second": args.latency_per_second,
+            "error_rate": args.error_rate, "rate_limit": args.rate_limit,
+        },
+        "scenarios": [],
+    }
+    try:
+        wait_for_port("127.0.0.1", args.port)
+        for seconds in lengths:
+            audio_path = os.path.join(workdir, f"speech_{seconds}s.ogg")
+            if not os.path.exists(audio_path):
+                generate_audio(ffmpeg_bin, audio_path, seconds)
+            for concurrency in levels:
+                jobs = args.jobs or concurrency * 2
+                queue = context.Queue()
+                process = context.Process(
+                    target=run_scenario, args=(env, audio_path, seconds, concurrency, jobs, queue)
+                )
+                process.start()
+                raw = queue.get()
+                process.join()
+                scenario = summarize(seconds, concurrency, jobs, raw)
+                results["scenarios"].append(scenario)
+                latency = scenario["latency_s"]
+                print(
+                    f"{seconds:>5} с × {concurrency:>3}: {scenario['audio_seconds_per_s']:>8.1f} с аудио/с, "
+                    f"p50 {latency['p50']:.2f} p95 {latency['p95']:.2f} p99 {latency['p99']:.2f} с, "
+                    f"RSS {scenario['peak_rss_mb']:.0f} МБ, ошибок: {scenario['failed']}"
+                )
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump(results, output, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("Регрессии относительно базового прогона:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("Регрессий относительно базового прогона нет")
+
+
+if __name__ == "__main__":
+    main()
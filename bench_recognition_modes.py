@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Сравнение синхронного (по фрагментам) и асинхронного режимов распознавания Salute Speech"""
+
+import os
+import sys
+import time
+import asyncio
+
+# Кэш отключается, чтобы оба режима действительно обращались к API
+os.environ["TRANSCRIPT_CACHE_PATH"] = ""
+
+import audio_transcription_bot as bot
+
+
+async def run_mode(name, transcription):
+    bot.salute_client.request_counts.clear()
+    started = time.monotonic()
+    transcript, errors = await transcription
+    elapsed = time.monotonic() - started
+    counts = dict(bot.salute_client.request_counts)
+    print(f"{name}: {elapsed:.2f} с, запросов: {sum(counts.values())} {counts}, символов: {len(transcript)}")
+    if errors:
+        print(f"  ошибки: {errors}")
+
+
+async def main(audio_path):
+    duration = await bot.probe_duration(audio_path)
+    print(f"Файл: {audio_path}, длительность: {duration:.1f} с")
+    # Токен получаем заранее, чтобы OAuth не попал в замер первого режима
+    await bot.get_salute_token()
+    try:
+        with bot.job_workspace() as workspace:
+            await run_mode("Синхронный", bot.transcribe_chunks(
+                bot.iter_audio_chunks(audio_path, workspace), os.path.basename(audio_path)
+            ))
+            await run_mode("Асинхронный", bot.transcribe_audio_async(audio_path, workspace=workspace))
+    finally:
+        await bot.salute_client.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Использование: {sys.argv[0]} <аудиофайл>")
+        sys.exit(1)
+    asyncio.run(main(sys.argv[1]))
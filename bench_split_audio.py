@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Замер пикового потребления памяти и процессорного времени при нарезке аудио"""
+
+import os
+import sys
+import time
+import asyncio
+import resource
+
+import audio_transcription_bot as bot
+
+
+async def run(audio_path):
+    chunks = await bot.split_audio(audio_path)
+    bot.remove_chunk_files(chunks)
+    return len(chunks)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(f"Использование: {sys.argv[0]} <аудиофайл>")
+        sys.exit(1)
+    audio_path = sys.argv[1]
+    started = time.monotonic()
+    chunks_count = asyncio.run(run(audio_path))
+    wall = time.monotonic() - started
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    print(f"Файл: {audio_path} ({os.path.getsize(audio_path) / 1024 / 1024:.1f} МБ), фрагментов: {chunks_count}")
+    print(f"Время: {wall:.2f} с")
+    print(f"CPU бота: {own.ru_utime + own.ru_stime:.2f} с, CPU ffmpeg: {children.ru_utime + children.ru_stime:.2f} с")
+    # ru_maxrss в Linux указывается в килобайтах
+    print(f"Пиковый RSS бота: {own.ru_maxrss / 1024:.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
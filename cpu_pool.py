@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Пул процессов для CPU-ёмких шагов обработки аудио"""
+
+import sys
+import types
+import signal
+import asyncio
+import logging
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def _ignore_sigint():
+    # Ctrl+C из терминала получает вся группа процессов; пулом управляет родитель,
+    # поэтому процессы пула не должны падать с KeyboardInterrupt сами
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+@contextmanager
+def _without_main():
+    # Процесс spawn перед запуском импортирует __main__ родителя (run_bot_local, job_worker,
+    # batch_transcribe), а с ним весь бот с telegram и httpx. Пока пул запускает процессы,
+    # __main__ подменяется пустым модулем, и процессы пула импортируют только модуль функции
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+class CpuPool:
+    """Выполняет функции в отдельных процессах, не занимая event loop.
+
+    Пул создаётся лениво при первом вызове. В пул одновременно отдаётся не
+    больше max_pending задач, остальные вызывающие ждут свободного места:
+    при перегрузке тормозит нарезка (а с ней и чтение из ffmpeg), а не
+    растёт очередь внутри пула. max_workers=0 выполняет функции прямо в
+    вызывающем потоке. Функции должны лежать в импортируемом модуле, а не в
+    __main__: процессы пула запускаются без него.
+    """
+
+    def __init__(self, max_workers, max_pending=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending or max_workers * 2
+        # Сколько раз вызывающему пришлось ждать из-за заполненного пула
+        self.saturated = 0
+        self._executor = None
+        self._slots = None
+
+    async def run(self, fn, *args):
+        if self.max_workers <= 0:
+            return fn(*args)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        if self._slots.locked():
+            self.saturated += 1
+        async with self._slots:
+            if self._executor is None:
+                # spawn, а не fork: у процесса уже есть потоки и открытые соединения
+                self._executor = ProcessPoolExecutor(
+                    self.max_workers, mp_context=multiprocessing.get_context("spawn"), initializer=_ignore_sigint
+                )
+                logger.info(f"Запущен пул процессов для обработки аудио: {self.max_workers}")
+            # Новые процессы пул запускает синхронно внутри submit, то есть внутри run_in_executor
+            with _without_main():
+                future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+            return await future
+
+    async def warm_up(self, fn, *args):
+        # Запускает все процессы пула сразу: иначе первые задания ждут запуска интерпретатора
+        # и импорта модулей функции в каждом новом процессе
+        await asyncio.gather(*(self.run(fn, *args) for _ in range(max(self.max_workers, 1))))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Участки аудиофайлов, которые читаются через mmap, а не загружаются в память целиком"""
+
+import os
+import mmap
+import hashlib
+from contextlib import contextmanager
+
+# Размер куска, которым участок отдаётся в HTTP-запрос
+PIECE_SIZE = 64 * 1024
+
+
+class FileSlice:
+    """Участок файла [offset, offset + length), например фрагмент PCM-файла задания.
+
+    Объект можно передать в httpx как content: при каждой итерации (в том
+    числе при повторе запроса) файл отображается заново и отдаётся кусками
+    по piece_size байт, так что в памяти одновременно лежит один кусок, а не
+    весь фрагмент. Файл открывается только на время операции.
+    """
+
+    def __init__(self, path, offset=0, length=None, piece_size=PIECE_SIZE):
+        self.path = path
+        self.offset = offset
+        self.length = os.path.getsize(path) - offset if length is None else length
+        self.piece_size = piece_size
+
+    def __len__(self):
+        return self.length
+
+    @contextmanager
+    def view(self):
+        with open(self.path, "rb") as source, mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)[self.offset:self.offset + self.length]
+            try:
+                yield view
+            finally:
+                # Пока на mmap есть memoryview, его нельзя закрыть
+                view.release()
+
+    def digest(self):
+        # sha256 прямо по отображённым страницам, без копии участка
+        with self.view() as view:
+            return hashlib.sha256(view).hexdigest()
+
+    def read(self):
+        with self.view() as view:
+            return bytes(view)
+
+    async def __aiter__(self):
+        with self.view() as view:
+            for start in range(0, len(view), self.piece_size):
+                yield bytes(view[start:start + self.piece_size])
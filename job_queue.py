@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Постоянная очередь заданий на распознавание"""
+
+import json
+import time
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Состояния задания: queued -> processing -> done -> delivered
+QUEUED = "queued"
+PROCESSING = "processing"
+DONE = "done"
+DELIVERED = "delivered"
+
+
+class JobQueue:
+    """Очередь в SQLite, общая для процесса бота и процессов-обработчиков.
+
+    Обработчик забирает задание с арендой на lease секунд и продлевает её,
+    пока работает. Если процесс упал, аренда истекает и задание снова
+    выдаётся следующему обработчику, но не больше max_attempts раз, чтобы
+    файл, который роняет обработчик, не зациклил очередь.
+
+    Порядок выдачи: сначала задания с большим priority (короткие голосовые),
+    внутри приоритета — взвешенная справедливая очередь по пользователям:
+    следующим обслуживается пользователь, у которого меньше всего
+    стоимости (секунд аудио) в работе и за последние fair_window секунд,
+    делённой на его вес из user_weights. Так один пользователь с десятком
+    длинных файлов не задерживает остальных.
+    """
+
+    def __init__(self, path, max_attempts=3, fair_window=3600, user_weights=None):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.fair_window = fair_window
+        self.user_weights = user_weights or {}
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            # isolation_level=None: транзакциями управляем сами через BEGIN IMMEDIATE
+            self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, state TEXT NOT NULL, "
+                "chat_id INTEGER NOT NULL, user_id INTEGER, message_id INTEGER, status_message_id INTEGER, "
+                "file_id TEXT NOT NULL, file_unique_id TEXT, file_ext TEXT, file_size INTEGER, duration REAL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, worker_id TEXT, lease_until REAL, "
+                "transcript TEXT, errors TEXT, error TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            # Очереди, созданные до появления справедливой выдачи
+            if "cost" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN cost REAL NOT NULL DEFAULT 0")
+            if "priority" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            if "output_format" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN output_format TEXT NOT NULL DEFAULT 'text'")
+            if "subtitles_path" not in columns:
+                # Субтитры лежат файлом на диске, в очереди хранится только путь к нему
+                self._db.execute("ALTER TABLE jobs ADD COLUMN subtitles_path TEXT")
+            if "delivery_attempts" not in columns:
+                # Доставка по частям и с повторами: текст уже отправлен, сколько попыток было, когда следующая
+                self._db.execute("ALTER TABLE jobs ADD COLUMN transcript_sent INTEGER NOT NULL DEFAULT 0")
+                self._db.execute("ALTER TABLE jobs ADD COLUMN delivery_attempts INTEGER NOT NULL DEFAULT 0")
+                self._db.execute("ALTER TABLE jobs ADD COLUMN deliver_after REAL NOT NULL DEFAULT 0")
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state, id)")
+        return self._db
+
+    def enqueue(self, chat_id, user_id, message_id, status_message_id, file_id, file_unique_id,
+                file_ext, file_size=None, duration=None, cost=0, priority=0, output_format="text"):
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO jobs (state, chat_id, user_id, message_id, status_message_id, file_id, file_unique_id, "
+            "file_ext, file_size, duration, cost, priority, output_format, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (QUEUED, chat_id, user_id, message_id, status_message_id, file_id, file_unique_id,
+             file_ext, file_size, duration, cost, priority, output_format, now, now)
+        )
+        return cursor.lastrowid
+
+    def _usage(self, db, now):
+        # Стоимость, уже выданная пользователям: в работе и завершённая за последние fair_window секунд
+        rows = db.execute(
+            "SELECT user_id, SUM(cost) AS cost FROM jobs WHERE state = ? OR (state != ? AND updated_at >= ?) "
+            "GROUP BY user_id",
+            (PROCESSING, QUEUED, now - self.fair_window)
+        ).fetchall()
+        return {row["user_id"]: row["cost"] or 0 for row in rows}
+
+    def _next(self, db, now, min_priority=0):
+        # Задания упавших обработчиков возвращаются в работу первыми
+        row = db.execute(
+            "SELECT * FROM jobs WHERE state = ? AND lease_until < ? AND priority >= ? ORDER BY id LIMIT 1",
+            (PROCESSING, now, min_priority)
+        ).fetchone()
+        if row is not None:
+            return row
+        # Кандидаты — самое старое задание каждого пользователя в каждом приоритете
+        heads = db.execute(
+            "SELECT * FROM jobs WHERE id IN (SELECT MIN(id) FROM jobs WHERE state = ? AND priority >= ? "
+            "GROUP BY user_id, priority)",
+            (QUEUED, min_priority)
+        ).fetchall()
+        if not heads:
+            return None
+        usage = self._usage(db, now)
+        return min(heads, key=lambda job: (
+            -job["priority"],
+            usage.get(job["user_id"], 0) / self.user_weights.get(job["user_id"], 1),
+            job["id"],
+        ))
+
+    def claim(self, worker_id, lease, priority_only=False):
+        # priority_only: обработчик держит последнее свободное место для коротких записей
+        db = self._connect()
+        while True:
+            now = time.time()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._next(db, now, 1 if priority_only else 0)
+                if row is None:
+                    db.execute("COMMIT")
+                    return None
+                if row["attempts"] >= self.max_attempts:
+                    db.execute(
+                        "UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                        (DONE, "Не удалось обработать аудио: обработка несколько раз прерывалась.", now, row["id"])
+                    )
+                    db.execute("COMMIT")
+                    logger.error(f"Задание {row['id']} снято после {row['attempts']} попыток")
+                    continue
+                if row["state"] == PROCESSING:
+                    logger.warning(f"Задание {row['id']} брошено обработчиком {row['worker_id']}, перезапускаю")
+                db.execute(
+                    "UPDATE jobs SET state = ?, worker_id = ?, lease_until = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE id = ?",
+                    (PROCESSING, worker_id, now + lease, now, row["id"])
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            job = dict(row)
+            job["attempts"] += 1
+            return job
+
+    def extend_lease(self, job_id, worker_id, lease):
+        self._connect().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND state = ? AND worker_id = ?",
+            (time.time() + lease, job_id, PROCESSING, worker_id)
+        )
+
+    def release(self, job_id, worker_id):
+        # Штатная остановка обработчика: задание возвращается в очередь без ожидания аренды
+        self._connect().execute(
+            "UPDATE jobs SET state = ?, worker_id = NULL, lease_until = NULL, attempts = attempts - 1, "
+            "updated_at = ? WHERE id = ? AND state = ? AND worker_id = ?",
+            (QUEUED, time.time(), job_id, PROCESSING, worker_id)
+        )
+
+    def complete(self, job_id, transcript=None, errors=None, error=None, subtitles_path=None):
+        self._connect().execute(
+            "UPDATE jobs SET state = ?, transcript = ?, errors = ?, error = ?, subtitles_path = ?, "
+            "lease_until = NULL, updated_at = ? WHERE id = ?",
+            (DONE, transcript, json.dumps(errors, ensure_ascii=False) if errors else None, error, subtitles_path,
+             time.time(), job_id)
+        )
+
+    def finished(self, limit=20):
+        # Готовые задания, доставку которых не отложили после сбоя
+        rows = self._connect().execute(
+            "SELECT * FROM jobs WHERE state = ? AND deliver_after <= ? ORDER BY id LIMIT ?", (DONE, time.time(), limit)
+        ).fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["errors"] = json.loads(job["errors"]) if job["errors"] else None
+            jobs.append(job)
+        return jobs
+
+    def pending(self, user_id=None):
+        # Число и суммарная стоимость заданий в очереди, всех или одного пользователя
+        query = "SELECT COUNT(*), COALESCE(SUM(cost), 0) FROM jobs WHERE state = ?"
+        params = (QUEUED,)
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params += (user_id,)
+        return tuple(self._connect().execute(query, params).fetchone())
+
+    def queued(self, limit=50):
+        return [dict(row) for row in self._connect().execute(
+            "SELECT * FROM jobs WHERE state = ? ORDER BY priority DESC, id LIMIT ?", (QUEUED, limit)
+        )]
+
+    def position(self, job):
+        # Задания того же или более высокого приоритета, пришедшие раньше. Справедливая выдача
+        # может взять задание и раньше, так что это оценка сверху — для сообщения пользователю её хватает
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE state = ? AND (priority > ? OR (priority = ? AND id < ?))",
+            (QUEUED, job["priority"], job["priority"], job["id"])
+        ).fetchone()[0] + 1
+
+    def counts(self):
+        rows = self._connect().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def mark_transcript_sent(self, job_id):
+        self._connect().execute("UPDATE jobs SET transcript_sent = 1 WHERE id = ?", (job_id,))
+
+    def postpone_delivery(self, job_id, delay):
+        self._connect().execute(
+            "UPDATE jobs SET delivery_attempts = delivery_attempts + 1, deliver_after = ? WHERE id = ?",
+            (time.time() + delay, job_id)
+        )
+
+    def mark_delivered(self, job_id):
+        self._connect().execute(
+            "UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?", (DELIVERED, time.time(), job_id)
+        )
+
+    def purge_delivered(self, max_age):
+        self._connect().execute(
+            "DELETE FROM jobs WHERE state = ? AND updated_at < ?", (DELIVERED, time.time() - max_age)
+        )
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
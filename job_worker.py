@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Процессы-обработчики очереди заданий на распознавание"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import asyncio
+import logging
+import multiprocessing
+
+from telegram import Bot
+
+import tracing
+import audio_transcription_bot as core
+from metrics import start_http_server
+
+logger = logging.getLogger(__name__)
+
+
+async def keep_lease(queue, worker_id, job_id):
+    # Пока задание в работе, аренда продлевается; упавший процесс перестаёт её продлевать
+    while True:
+        await asyncio.sleep(core.JOB_LEASE_SECONDS / 3)
+        queue.extend_lease(job_id, worker_id, core.JOB_LEASE_SECONDS)
+
+
+async def run_job(bot, queue, worker_id, job):
+    # run_job — отдельная задача, поэтому trace_id не смешивается с соседними заданиями
+    tracing.set_trace_id(f"job{job['id']}")
+    core.stage_seconds.observe(max(0.0, time.time() - job["created_at"]), stage="queue_wait")
+    logger.info(f"Обработчик {worker_id} взял задание {job['id']} (попытка {job['attempts']})")
+    heartbeat = asyncio.create_task(keep_lease(queue, worker_id, job["id"]))
+    started = time.monotonic()
+    try:
+        transcript, errors, error, subtitles_path = await core.process_job(bot, job)
+        queue.complete(job["id"], transcript, errors, error, subtitles_path)
+        core.stage_seconds.observe(time.monotonic() - started, stage="job")
+        core.jobs_total.inc(result="error" if error else "partial" if errors else "ok")
+        logger.info(f"Задание {job['id']} выполнено")
+    except asyncio.CancelledError:
+        # Остановка процесса: задание сразу возвращается в очередь, а уже
+        # распознанные фрагменты при повторе возьмутся из кэша
+        queue.release(job["id"], worker_id)
+        logger.info(f"Задание {job['id']} возвращено в очередь")
+        raise
+    except Exception as e:
+        logger.exception(f"Ошибка при выполнении задания {job['id']}")
+        core.jobs_total.inc(result="error")
+        queue.complete(job["id"], error=f"Произошла ошибка при обработке аудио: {str(e)}")
+    finally:
+        heartbeat.cancel()
+
+
+async def worker_loop(worker_id, concurrency, metrics_port=0, ready=None, processes=1):
+    # processes — сколько обработчиков запущено вместе с этим; они делят квоту Salute Speech
+    core.share_recognition_limit(processes)
+    queue = core.job_queue
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: остановка только через завершение процесса
+            pass
+    logger.info(
+        f"Обработчик {worker_id} запущен, заданий одновременно: {concurrency}, "
+        f"распознаваний одновременно: {core.recognition_scheduler.global_limit}"
+    )
+    running = set()
+    # Задания вне быстрой полосы: они не занимают последнее место, чтобы короткое голосовое
+    # не ждало часами, пока освободится обработчик
+    regular = set()
+    stop_waiter = asyncio.create_task(stop.wait())
+    lag_monitor = asyncio.create_task(core.loop_lag.run())
+    # Временные каталоги заданий чистит процесс бота; живые каталоги защищаются обновлением их времени
+    workspace_toucher = asyncio.create_task(core.touch_workspaces())
+    metrics_server = None
+    if metrics_port:
+        metrics_server = await start_http_server(
+            core.metrics, metrics_port, core.METRICS_HOST, ready=core.startup.is_ready
+        )
+    # Задания берутся после прогрева, но не позже STARTUP_WARMUP_TIMEOUT: если API недоступен,
+    # прогрев продолжается в фоне, а задания дождутся его через повторы клиента
+    warming = asyncio.create_task(core.keep_warming(ready))
+    await asyncio.wait({warming, stop_waiter}, timeout=core.STARTUP_WARMUP_TIMEOUT,
+                       return_when=asyncio.FIRST_COMPLETED)
+    try:
+        async with Bot(
+            core.TELEGRAM_TOKEN,
+            base_url=f"{core.TELEGRAM_API_URL}/bot",
+            base_file_url=f"{core.TELEGRAM_API_URL}/file/bot",
+        ) as bot:
+            while not stop.is_set():
+                if len(running) >= concurrency:
+                    await asyncio.wait(running | {stop_waiter}, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                priority_only = concurrency > 1 and len(regular) >= concurrency - 1
+                job = queue.claim(worker_id, core.JOB_LEASE_SECONDS, priority_only)
+                if job is None:
+                    await asyncio.wait({stop_waiter}, timeout=core.JOB_POLL_INTERVAL)
+                    continue
+                task = asyncio.create_task(run_job(bot, queue, worker_id, job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                if not job["priority"]:
+                    regular.add(task)
+                    task.add_done_callback(regular.discard)
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+    finally:
+        stop_waiter.cancel()
+        warming.cancel()
+        lag_monitor.cancel()
+        workspace_toucher.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+        await core.salute_client.close()
+        core.transcript_cache.close()
+        queue.close()
+        core.cpu_pool.close()
+        logger.info(f"Обработчик {worker_id} остановлен")
+
+
+def worker_process(concurrency, metrics_port=0, ready=None, processes=1):
+    asyncio.run(worker_loop(f"{socket.gethostname()}:{os.getpid()}", concurrency, metrics_port, ready, processes))
+
+
+def start_worker(context, index, count, concurrency):
+    # Не daemon: у обработчика свой пул процессов, а daemon-процессам нельзя иметь дочерние
+    ready = context.Event()
+    process = context.Process(
+        target=worker_process, name=f"job-worker-{index + 1}",
+        args=(concurrency, core.METRICS_PORT + index + 1 if core.METRICS_PORT else 0, ready, count)
+    )
+    process.start()
+    return process, ready
+
+
+def start_workers(count, concurrency):
+    # spawn, а не fork: процесс бота к этому моменту уже держит соединения и потоки.
+    # Возвращает процессы и их события готовности (выставляются после прогрева)
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    ready_events = []
+    for i in range(count):
+        process, ready = start_worker(context, i, count, concurrency)
+        processes.append(process)
+        ready_events.append(ready)
+    logger.info(f"Запущено обработчиков очереди: {count}")
+    return processes, ready_events
+
+
+async def supervise_workers(processes, ready_events, concurrency, interval):
+    # Перезапускает обработчики, упавшие с ошибкой (исключение в worker_loop, OOM killer), на том же
+    # месте списков, так что остановка бота и проверка готовности видят новый процесс. Код 0 —
+    # штатная остановка по SIGTERM или SIGINT, такой обработчик не перезапускается
+    context = multiprocessing.get_context("spawn")
+    while True:
+        await asyncio.sleep(interval)
+        for i, process in enumerate(processes):
+            if process.is_alive() or process.exitcode == 0:
+                continue
+            logger.error(
+                f"Обработчик {process.name} (pid {process.pid}) завершился с кодом {process.exitcode}, перезапускаю"
+            )
+            core.worker_restarts_total.inc()
+            processes[i], ready_events[i] = start_worker(context, i, len(processes), concurrency)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else max(core.JOB_WORKERS, 1)
+    processes, _ = start_workers(count, core.JOB_WORKER_CONCURRENCY)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # SIGINT от терминала получают и обработчики, остаётся дождаться их
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
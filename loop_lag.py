@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Замер задержки event loop"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """Проверяет, насколько позже положенного просыпается asyncio.sleep(interval).
+
+    Задержка показывает, сколько времени loop был занят синхронным кодом и
+    не обслуживал остальные задачи. Раз в report_interval секунд в лог
+    пишутся p50/p99/максимум за период; отдельные задержки больше
+    warn_threshold пишутся сразу.
+    """
+
+    def __init__(self, interval=0.1, report_interval=60.0, warn_threshold=0.1):
+        self.interval = interval
+        self.report_interval = report_interval
+        self.warn_threshold = warn_threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._samples = []
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        report_at = loop.time() + self.report_interval
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._samples.append(lag)
+            if lag > self.warn_threshold:
+                logger.warning(f"Event loop был занят {lag * 1000:.0f} мс")
+            if loop.time() >= report_at:
+                self.report()
+                report_at = loop.time() + self.report_interval
+
+    def stats(self):
+        samples = sorted(self._samples)
+        if not samples:
+            return {"p50": 0.0, "p99": 0.0, "max": 0.0}
+        return {
+            "p50": samples[len(samples) // 2],
+            "p99": samples[min(len(samples) - 1, len(samples) * 99 // 100)],
+            "max": samples[-1],
+        }
+
+    def report(self):
+        stats = self.stats()
+        logger.info(
+            f"Задержка event loop: p50 {stats['p50'] * 1000:.1f} мс, p99 {stats['p99'] * 1000:.1f} мс, "
+            f"макс {stats['max'] * 1000:.1f} мс"
+        )
+        self._samples = []
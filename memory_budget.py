@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Общий лимит памяти под аудиоданные заданий"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class MemoryBudget:
+    """Учитывает байты, которые задания держат в памяти, и не даёт превысить limit.
+
+    reserve() ждёт, пока освободится нужный объём: новое задание не начнёт
+    декодирование, пока память заняты другими. try_reserve() не ждёт и
+    нужен там, где есть менее прожорливый запасной путь.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._released = None
+
+    def _event(self):
+        if self._released is None:
+            self._released = asyncio.Event()
+        return self._released
+
+    def _fits(self, size):
+        # Заявка больше всего лимита пропускается, когда больше никто ничего не держит
+        return self.used + size <= self.limit or self.used == 0
+
+    def try_reserve(self, size):
+        if not self._fits(size):
+            return False
+        self.used += size
+        return True
+
+    def release(self, size):
+        self.used -= size
+        self._event().set()
+
+    @asynccontextmanager
+    async def reserve(self, size):
+        while not self._fits(size):
+            event = self._event()
+            event.clear()
+            await event.wait()
+        self.used += size
+        try:
+            yield
+        finally:
+            self.release(size)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Локальная замена Salute Speech API и Telegram Bot API для тестов и замеров без сети"""
+
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import logging
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Сырой PCM 16 кГц 16 бит моно: байт на секунду аудио
+PCM_BYTES_PER_SECOND = 32000
+# FLAC речи примерно вдвое меньше PCM; точность не нужна, это только оценка длительности
+FLAC_BYTES_PER_SECOND = 16000
+
+
+class MockState:
+    """Настройки и состояние mock-сервера.
+
+    Время ответа на распознавание: latency + latency_per_second × длительность
+    аудио, со случайным разбросом ±jitter. error_rate — доля ответов 500,
+    rate_limit — запросов в секунду к методам распознавания (0 — без лимита),
+    сверх лимита отвечаем 429 с Retry-After.
+    """
+
+    def __init__(self, latency=0.2, latency_per_second=0.01, jitter=0.2, error_rate=0.0,
+                 rate_limit=0.0, token_ttl=1800, voice_file=None, voice_updates=0, voice_duration=10):
+        self.latency = latency
+        self.latency_per_second = latency_per_second
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.token_ttl = token_ttl
+        self.counts = Counter()
+        self.tokens = set()
+        self._bucket = rate_limit
+        self._bucket_at = time.monotonic()
+        # Асинхронное распознавание: загруженные файлы и задачи
+        self.uploads = {}
+        self.tasks = {}
+        # Telegram: файл, который отдаётся на любой getFile, и очередь входящих обновлений
+        self.voice_file = voice_file
+        self.voice_duration = voice_duration
+        self.updates = []
+        self.update_id = 0
+        self.message_id = 0
+        for _ in range(voice_updates):
+            self.add_voice_update()
+
+    def add_voice_update(self, chat_id=1, user_id=1):
+        self.update_id += 1
+        self.message_id += 1
+        self.updates.append({
+            "update_id": self.update_id,
+            "message": {
+                "message_id": self.message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+                "voice": {
+                    "file_id": f"voice{self.update_id}",
+                    "file_unique_id": f"voice{self.update_id}",
+                    "duration": self.voice_duration,
+                    "mime_type": "audio/ogg",
+                    "file_size": self._voice_size(),
+                },
+            },
+        })
+
+    def _voice_size(self):
+        if not self.voice_file:
+            return 0
+        with open(self.voice_file, "rb") as voice:
+            return len(voice.read())
+
+    def _take_rate_token(self):
+        if self.rate_limit <= 0:
+            return True
+        now = time.monotonic()
+        self._bucket = min(self.rate_limit, self._bucket + (now - self._bucket_at) * self.rate_limit)
+        self._bucket_at = now
+        if self._bucket >= 1:
+            self._bucket -= 1
+            return True
+        return False
+
+    async def simulate(self, audio_seconds):
+        """Задержка и возможная ошибка для метода распознавания: (статус, заголовки) или None"""
+        if not self._take_rate_token():
+            self.counts["429"] += 1
+            return 429, {"Retry-After": "1"}
+        delay = self.latency + self.latency_per_second * audio_seconds
+        await asyncio.sleep(max(0.0, delay * random.uniform(1 - self.jitter, 1 + self.jitter)))
+        if random.random() < self.error_rate:
+            self.counts["500"] += 1
+            return 500, {}
+        return None
+
+
+def _response(status, body=b"", content_type="application/json", headers=None):
+    if not isinstance(body, (bytes, bytearray)):
+        body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    reason = {200: "OK", 401: "Unauthorized", 404: "Not Found", 429: "Too Many Requests",
+              500: "Internal Server Error"}.get(status, "OK")
+    head = f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+    for name, value in (headers or {}).items():
+        head += f"{name}: {value}\r\n"
+    return (head + "\r\n").encode("latin-1") + body
+
+
+def _form(headers, body):
+    # Bot API: PTB шлёт параметры формой, сами значения — JSON; multipart (sendDocument) не разбираем
+    content_type = headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return {key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}
+    return {}
+
+
+def async_result(seconds, phrase_seconds=5):
+    # Как у настоящего API: фраза на каждые несколько секунд, с границами и разметкой слов вида "1.200s"
+    utterances = []
+    for number, start in enumerate(range(0, max(1, int(seconds)), phrase_seconds), start=1):
+        words = [("фраза", start + 0.2, start + 0.8), (str(number), start + 0.9, start + 1.5)]
+        utterances.append({
+            "results": [{
+                "text": f"фраза {number}",
+                "normalized_text": f"Фраза {number}.",
+                "start": f"{start + 0.2:.3f}s",
+                "end": f"{start + 1.5:.3f}s",
+                "word_alignments": [{"word": w, "start": f"{b:.3f}s", "end": f"{e:.3f}s"} for w, b, e in words],
+            }],
+            "eou": True,
+            "processed_audio_start": f"{start}s",
+            "processed_audio_end": f"{min(seconds, start + phrase_seconds):.3f}s",
+        })
+    return utterances
+
+
+async def handle_salute(state, method, path, query, headers, body):
+    if path.endswith("/oauth"):
+        state.counts["oauth"] += 1
+        token = uuid.uuid4().hex
+        state.tokens.add(token)
+        return _response(200, {"access_token": token, "expires_at": int((time.time() + state.token_ttl) * 1000)})
+    if headers.get("authorization", "").removeprefix("Bearer ") not in state.tokens:
+        return _response(401, {"status": 401, "message": "unauthorized"})
+    if path.endswith("/speech:recognize"):
+        state.counts["recognize"] += 1
+        seconds = len(body) / PCM_BYTES_PER_SECOND
+        failure = await state.simulate(seconds)
+        if failure:
+            return _response(failure[0], {"status": failure[0]}, headers=failure[1])
+        return _response(200, {"status": 200, "result": [f"распознано {seconds:.1f} с аудио"]})
+    if path.endswith("/data:upload"):
+        state.counts["upload"] += 1
+        file_id = uuid.uuid4().hex
+        state.uploads[file_id] = len(body)
+        return _response(200, {"status": 200, "result": {"request_file_id": file_id}})
+    if path.endswith("/speech:async_recognize"):
+        state.counts["async_recognize"] += 1
+        failure = await state.simulate(0)
+        if failure:
+            return _response(failure[0], {"status": failure[0]}, headers=failure[1])
+        request = json.loads(body)
+        seconds = state.uploads.pop(request["request_file_id"], 0) / FLAC_BYTES_PER_SECOND
+        task_id = uuid.uuid4().hex
+        state.tasks[task_id] = (time.monotonic() + state.latency + state.latency_per_second * seconds, seconds)
+        return _response(200, {"status": 200, "result": {"id": task_id, "status": "NEW"}})
+    if path.endswith("/task:get"):
+        state.counts["task"] += 1
+        task_id = query.get("id", [""])[0]
+        ready_at, _ = state.tasks[task_id]
+        status = "DONE" if time.monotonic() >= ready_at else "RUNNING"
+        return _response(200, {"status": 200, "result": {"id": task_id, "status": status, "response_file_id": task_id}})
+    if path.endswith("/data:download"):
+        state.counts["download"] += 1
+        _, seconds = state.tasks.pop(query.get("response_file_id", [""])[0])
+        return _response(200, async_result(seconds))
+    return _response(404, {"status": 404})
+
+
+async def handle_telegram(state, method, path, headers, body):
+    if path.startswith("/file/"):
+        state.counts["tg_file"] += 1
+        with open(state.voice_file, "rb") as voice:
+            return _response(200, voice.read(), content_type="application/octet-stream")
+    api_method = path.rsplit("/", 1)[-1]
+    params = _form(headers, body)
+    state.counts[f"tg_{api_method}"] += 1
+    chat = {"id": int(params.get("chat_id", 1)), "type": "private"}
+    if api_method == "getMe":
+        result = {"id": 1, "is_bot": True, "first_name": "Mock", "username": "mock_bot"}
+    elif api_method in ("deleteWebhook", "setWebhook", "setMyCommands"):
+        result = True
+    elif api_method == "getUpdates":
+        offset = int(params.get("offset", 0) or 0)
+        state.updates = [update for update in state.updates if update["update_id"] >= offset]
+        if not state.updates:
+            # Длинный опрос: не крутим клиента в цикле, но и не держим дольше секунды
+            await asyncio.sleep(min(float(params.get("timeout", 0) or 0), 1.0))
+        result = state.updates[:int(params.get("limit", 100) or 100)]
+    elif api_method == "getFile":
+        result = {"file_id": params.get("file_id"), "file_unique_id": params.get("file_id"),
+                  "file_size": state._voice_size(), "file_path": "voice/voice.ogg"}
+    elif api_method in ("sendMessage", "editMessageText", "sendDocument"):
+        state.message_id += 1
+        result = {"message_id": int(params.get("message_id", state.message_id)), "date": int(time.time()),
+                  "chat": chat, "text": params.get("text", "")}
+    else:
+        result = True
+    return _response(200, {"ok": True, "result": result})
+
+
+async def handle_connection(state, reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            url = urlsplit(target)
+            if url.path.startswith(("/bot", "/file/")):
+                response = await handle_telegram(state, method, url.path, headers, body)
+            elif url.path == "/mock/stats":
+                response = _response(200, dict(state.counts))
+            elif url.path == "/mock/updates" and method == "POST":
+                count = int(parse_qs(url.query).get("count", ["1"])[0])
+                for _ in range(count):
+                    state.add_voice_update()
+                response = _response(200, {"queued": len(state.updates)})
+            else:
+                response = await handle_salute(state, method, url.path, parse_qs(url.query), headers, body)
+            writer.write(response)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(state, host="127.0.0.1", port=8089):
+    server = await asyncio.start_server(lambda r, w: handle_connection(state, r, w), host, port)
+    logger.info(f"Mock Salute Speech / Telegram на http://{host}:{port}")
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.2, help="базовое время ответа распознавания, с")
+    parser.add_argument("--latency-per-second", type=float, default=0.01, help="добавка на секунду аудио, с")
+    parser.add_argument("--jitter", type=float, default=0.2, help="случайный разброс времени ответа, доля")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="запросов распознавания в секунду (0 — без лимита)")
+    parser.add_argument("--token-ttl", type=float, default=1800, help="срок жизни OAuth-токена, с")
+    parser.add_argument("--voice-file", help="файл, который отдаётся ботам как голосовое сообщение")
+    parser.add_argument("--voice-updates", type=int, default=0, help="сколько голосовых сообщений отдать через getUpdates")
+    parser.add_argument("--voice-duration", type=int, default=10, help="длительность голосового в обновлениях, с")
+    return parser.parse_args(argv)
+
+
+async def main(args):
+    state = MockState(
+        latency=args.latency, latency_per_second=args.latency_per_second, jitter=args.jitter,
+        error_rate=args.error_rate, rate_limit=args.rate_limit, token_ttl=args.token_ttl,
+        voice_file=args.voice_file, voice_updates=args.voice_updates, voice_duration=args.voice_duration,
+    )
+    server = await serve(state, args.host, args.port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Показ промежуточных результатов распознавания в статусном сообщении"""
+
+import asyncio
+import logging
+
+from telegram.error import RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Лимит Telegram на длину сообщения с запасом под строку прогресса
+PREVIEW_LIMIT = 3800
+
+
+def format_progress(done_ms, total_ms, text):
+    if total_ms:
+        percent = min(100, done_ms * 100 // total_ms)
+        header = f"Распознано {percent}% ({done_ms // 1000} из {total_ms // 1000} с)"
+    else:
+        header = f"Распознано {done_ms // 1000} с аудио"
+    if len(text) > PREVIEW_LIMIT:
+        text = "…" + text[-PREVIEW_LIMIT:]
+    return f"{header}\n\n{text}" if text else header
+
+
+class ProgressReporter:
+    """Редактирует статусное сообщение не чаще одного раза в min_interval секунд.
+
+    update() только запоминает новое состояние и не ждёт Telegram, поэтому
+    распознавание фрагментов не тормозит из-за редактирования сообщения;
+    промежуточные состояния между правками просто пропускаются.
+    """
+
+    def __init__(self, edit_text, min_interval=3.0):
+        # edit_text — корутина, меняющая текст статусного сообщения, например
+        # functools.partial(bot.edit_message_text, chat_id=..., message_id=...)
+        self.edit_text = edit_text
+        self.min_interval = min_interval
+        self._text = None
+        self._sent_text = None
+        self._changed = asyncio.Event()
+        self._task = None
+
+    def update(self, done_ms, total_ms, text):
+        self.show(format_progress(done_ms, total_ms, text))
+
+    def show(self, text):
+        # Готовый текст статуса, когда процент и промежуточный текст неизвестны (асинхронное распознавание)
+        self._text = text
+        self._changed.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            await self._edit(self._text)
+            await asyncio.sleep(self.min_interval)
+
+    async def _edit(self, text):
+        if text == self._sent_text:
+            return
+        try:
+            await self.edit_text(text)
+            self._sent_text = text
+        except RetryAfter as e:
+            logger.warning(f"Telegram ограничил частоту правок, жду {e.retry_after} с")
+            await asyncio.sleep(e.retry_after)
+            self._changed.set()
+        except TelegramError as e:
+            # BadRequest, таймауты и сетевые сбои: правка пропускается, следующее состояние отправится в свой черёд
+            logger.warning(f"Не удалось обновить статусное сообщение: {e}")
+
+    async def finish(self, text):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                # Упавшая правка статуса не должна стоить заданию уже готового текста
+                logger.warning(f"Показ промежуточных результатов остановился с ошибкой: {e}")
+            self._task = None
+        await self._edit(text)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Повторы запросов к Salute Speech: классификация ошибок, паузы и автомат-предохранитель"""
+
+import time
+import random
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Классы ошибок: повторять имеет смысл только временные сбои и превышение лимита
+TRANSIENT = "transient"
+RATE_LIMITED = "rate_limited"
+FATAL = "fatal"
+
+
+def classify(error):
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        if status == 429:
+            return RATE_LIMITED
+        # 408 и 5xx — сбой на стороне API
+        if status == 408 or status >= 500:
+            return TRANSIENT
+        # Остальные 4xx: файл или параметры не подходят, повтор даст тот же ответ. Сюда же 401:
+        # от OAuth он значит неверный ключ, а от API приходит уже после повтора со свежим токеном
+        return FATAL
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError)):
+        return TRANSIENT
+    return FATAL
+
+
+def retry_after(error):
+    """Пауза из заголовка Retry-After в секундах или None"""
+    if not isinstance(error, httpx.HTTPStatusError):
+        return None
+    value = error.response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Экспоненциальная пауза с полным джиттером: случайная от 0 до base_delay * 2^n.
+
+    Джиттер разносит повторы фрагментов одного задания во времени, чтобы
+    после сбоя они не ударили по API одновременно. Retry-After от сервера
+    важнее расчётной паузы, но не больше max_delay.
+    """
+
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error, attempt):
+        return attempt < self.max_attempts and classify(error) != FATAL
+
+    def delay(self, error, attempt):
+        server_delay = retry_after(error)
+        if server_delay is not None:
+            return min(server_delay, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Останавливает все запросы к API, пока оно недоступно.
+
+    После failure_threshold временных сбоев подряд предохранитель
+    размыкается: новые запросы ждут reset_timeout секунд вместо того, чтобы
+    тратить квоту и попытки на заведомо неудачные вызовы. Затем проходит
+    один пробный запрос; если он удался, работа продолжается, если нет —
+    снова пауза. Ошибки самого аудио (FATAL) на предохранитель не влияют.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, max_wait=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        # Сколько запрос готов ждать закрытия предохранителя, прежде чем сдаться
+        self.max_wait = max_wait
+        self.failures = 0
+        self.opened_at = None
+        self._probe = asyncio.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    async def wait(self):
+        waited = 0.0
+        while self.is_open:
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining <= 0 and not self._probe.locked():
+                # Пробный запрос: остальные ждут его результата
+                await self._probe.acquire()
+                return True
+            if self.max_wait is not None and waited >= self.max_wait:
+                raise CircuitOpenError("Salute Speech API недоступен, распознавание приостановлено")
+            pause = max(remaining, 1.0)
+            await asyncio.sleep(pause)
+            waited += pause
+        return False
+
+    def record(self, error, probe=False):
+        if probe:
+            self._probe.release()
+        if error is None:
+            if self.is_open:
+                logger.info("Salute Speech API снова отвечает, распознавание возобновлено")
+            self.failures = 0
+            self.opened_at = None
+            return
+        if classify(error) == FATAL:
+            return
+        self.failures += 1
+        if probe or (not self.is_open and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            logger.error(
+                f"Salute Speech API недоступен ({self.failures} сбоев подряд), "
+                f"запросы приостановлены на {self.reset_timeout:.0f} с"
+            )
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Асинхронный клиент Salute Speech API"""
+
+import time
+import uuid
+import asyncio
+import logging
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+
+import httpx
+
+from retry_policy import CircuitBreaker, RetryPolicy, classify
+
+logger = logging.getLogger(__name__)
+
+OAUTH_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
+API_URL = "https://smartspeech.sber.ru/rest/v1"
+# Пути методов относительно API_URL. Асинхронное распознавание: загрузка файла,
+# создание задачи, опрос статуса, скачивание результата
+RECOGNIZE_PATH = "/speech:recognize"
+UPLOAD_PATH = "/data:upload"
+ASYNC_RECOGNIZE_PATH = "/speech:async_recognize"
+TASK_PATH = "/task:get"
+DOWNLOAD_PATH = "/data:download"
+
+# Результат распознавания: текст и гипотезы по фразам в виде, в каком их вернул API
+# (text/normalized_text, а у асинхронного режима ещё start/end и word_alignments)
+Recognition = namedtuple("Recognition", ["text", "hypotheses"])
+
+
+class TokenManager:
+    """OAuth-токен с однократным обновлением и фоновым продлением.
+
+    Одновременные запросы при истёкшем токене ждут одного общего обновления,
+    а фоновая задача получает новый токен за refresh_margin секунд до
+    истечения старого, так что запросы пользователей не ждут OAuth.
+    """
+
+    def __init__(self, fetch, refresh_margin=300.0, retry_delay=10.0):
+        self._fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+        self._token = None
+        self._expiration = datetime.now()
+        self._lock = asyncio.Lock()
+        self._refresh_task = None
+
+    def _is_valid(self):
+        return self._token and self._expiration > datetime.now() + timedelta(minutes=1)
+
+    async def get(self):
+        if self._is_valid():
+            return self._token
+        async with self._lock:
+            # Пока ждали блокировку, токен мог обновить другой запрос
+            if not self._is_valid():
+                await self._refresh()
+        self._ensure_background_refresh()
+        return self._token
+
+    async def _refresh(self):
+        self._token, self._expiration = await self._fetch()
+        logger.info(f"Получен токен, действителен до {self._expiration}")
+
+    def invalidate(self, token):
+        # Сбрасываем только тот токен, который отклонил сервер, а не уже обновлённый
+        if token == self._token:
+            self._token = None
+
+    def _ensure_background_refresh(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            remaining = (self._expiration - datetime.now()).total_seconds()
+            # Если токен живёт не дольше refresh_margin (короткие токены, неверная настройка),
+            # обновляем его на половине оставшегося срока, но не чаще раза в retry_delay секунд
+            await asyncio.sleep(max(remaining - self.refresh_margin, remaining / 2, self.retry_delay))
+            try:
+                async with self._lock:
+                    await self._refresh()
+            except Exception as e:
+                logger.error(f"Ошибка фонового обновления токена: {e}")
+                await asyncio.sleep(self.retry_delay)
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+
+class SaluteSpeechClient:
+    """Клиент Salute Speech с одним долгоживущим пулом HTTP-соединений.
+
+    Сессия создаётся лениво внутри работающего event loop и переиспользуется
+    всеми обработчиками, поэтому TLS-рукопожатие и TCP-соединения не
+    повторяются на каждый фрагмент.
+    """
+
+    def __init__(self, api_key, scope="SALUTE_SPEECH_PERS", max_connections=20,
+                 max_keepalive_connections=10, keepalive_expiry=60.0,
+                 connect_timeout=10.0, token_timeout=10.0, recognize_timeout=120.0,
+                 token_refresh_margin=300.0, async_poll_interval=2.0, async_timeout=3600.0,
+                 retry_policy=None, circuit_breaker=None, oauth_url=OAUTH_URL, api_url=API_URL, verify=False):
+        self.api_key = api_key
+        # Адреса можно переопределить, например для локального mock_server.py
+        self.oauth_url = oauth_url
+        self.api_url = api_url.rstrip("/")
+        self.scope = scope
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.connect_timeout = connect_timeout
+        self.token_timeout = token_timeout
+        self.recognize_timeout = recognize_timeout
+        self.async_poll_interval = async_poll_interval
+        self.async_timeout = async_timeout
+        self.verify = verify
+        self._http = None
+        # Число HTTP-запросов по видам: для сравнения режимов распознавания
+        self.request_counts = Counter()
+        # Число повторов по классам ошибок
+        self.retry_counts = Counter()
+        self.retry = retry_policy or RetryPolicy()
+        self.breaker = circuit_breaker or CircuitBreaker()
+        self.tokens = TokenManager(self._fetch_token, refresh_margin=token_refresh_margin)
+
+    def _get_http(self):
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=httpx.Timeout(self.recognize_timeout, connect=self.connect_timeout),
+                verify=self.verify,
+            )
+        return self._http
+
+    def _timeout(self, total):
+        return httpx.Timeout(total, connect=self.connect_timeout)
+
+    async def _fetch_token(self):
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": "application/json",
+            "RqUID": str(uuid.uuid4()),
+            "Authorization": f"Basic {self.api_key}"
+        }
+        self.request_counts["oauth"] += 1
+        response = await self._get_http().post(
+            self.oauth_url, headers=headers, data={"scope": self.scope},
+            timeout=self._timeout(self.token_timeout)
+        )
+        response.raise_for_status()
+        response_data = response.json()
+        return response_data["access_token"], datetime.fromtimestamp(response_data["expires_at"] / 1000)
+
+    async def warm_up(self, connections=1):
+        # Открывает соединения с API заранее, чтобы TCP и TLS-рукопожатия не достались первым фрагментам.
+        # Ответ не важен (корень API без токена отвечает ошибкой): соединение после него остаётся в пуле
+        # на keepalive_expiry секунд. Возвращает число открытых соединений
+        http = self._get_http()
+
+        async def connect():
+            self.request_counts["warmup"] += 1
+            try:
+                await http.get(self.api_url, timeout=self._timeout(self.connect_timeout))
+                return True
+            except httpx.HTTPError as e:
+                logger.warning(f"Не удалось открыть соединение с {self.api_url}: {e}")
+                return False
+
+        return sum(await asyncio.gather(*(connect() for _ in range(connections))))
+
+    async def get_token(self):
+        try:
+            return await self.tokens.get()
+        except Exception as e:
+            logger.error(f"Ошибка получения токена: {e}")
+            return None
+
+    async def _send(self, kind, method, url, headers=None, timeout=None, **kwargs):
+        # Ошибка OAuth пробрасывается как есть, чтобы её можно было классифицировать для повтора
+        token = await self.tokens.get()
+        headers = {**(headers or {}), "Authorization": f"Bearer {token}"}
+        self.request_counts[kind] += 1
+        response = await self._get_http().request(
+            method, url, headers=headers, timeout=self._timeout(timeout or self.recognize_timeout), **kwargs
+        )
+        if response.status_code == 401:
+            self.tokens.invalidate(token)
+        return response
+
+    async def _request(self, kind, method, url, **kwargs):
+        # Повторы идут внутри слота планировщика: при сбоях API одновременных
+        # запросов становится меньше, а не больше
+        attempt = 0
+        while True:
+            attempt += 1
+            probe = await self.breaker.wait()
+            error = None
+            try:
+                response = await self._send(kind, method, url, **kwargs)
+                if response.status_code == 401:
+                    # Токен отозван или истёк раньше срока: получаем новый и повторяем один раз
+                    logger.warning("Salute Speech отклонил токен, запрашиваю новый")
+                    response = await self._send(kind, method, url, **kwargs)
+                response.raise_for_status()
+                return response
+            except BaseException as e:
+                error = e
+                if not self.retry.should_retry(e, attempt):
+                    raise
+            finally:
+                self.breaker.record(error, probe)
+            delay = self.retry.delay(error, attempt)
+            self.retry_counts[classify(error)] += 1
+            logger.warning(
+                f"Запрос {kind} не удался ({error}), попытка {attempt + 1}/{self.retry.max_attempts} "
+                f"через {delay:.1f} с"
+            )
+            await asyncio.sleep(delay)
+
+    async def recognize(self, audio_content, language="ru-RU", model="general"):
+        try:
+            response = await self._request(
+                "recognize", "POST", self.api_url + RECOGNIZE_PATH, content=audio_content,
+                # Длина задаётся явно: content может быть FileSlice, который httpx читает кусками
+                headers={"Content-Type": "audio/x-pcm;bit=16;rate=16000", "Content-Length": str(len(audio_content))},
+                params={"language": language, "model": model}
+            )
+            result = response.json()
+            text = ""
+            if "status" in result and result["status"] == 200:
+                if "result" in result and len(result["result"]) > 0:
+                    text = result["result"][0]
+            elif "results" in result and len(result["results"]) > 0:
+                text = result["results"][0].get("alternatives", [{}])[0].get("transcript", "")
+            # Синхронный метод не размечает время, его восстанавливают по границам фрагментов
+            return Recognition(text, [{"text": text}] if text else [])
+        except Exception as e:
+            logger.error(f"Ошибка при распознавании аудио: {e}")
+            raise
+
+    async def start_async(self, audio_content, content_type="audio/flac", audio_encoding="FLAC",
+                          sample_rate=16000, language="ru-RU", model="general"):
+        # Загружает файл и создаёт задачу асинхронного распознавания, возвращает её id.
+        # Один файл целиком вместо десятков запросов speech:recognize по минутным фрагментам
+        try:
+            response = await self._request(
+                "upload", "POST", self.api_url + UPLOAD_PATH, content=audio_content,
+                headers={"Content-Type": content_type, "Content-Length": str(len(audio_content))}
+            )
+            request_file_id = response.json()["result"]["request_file_id"]
+            response = await self._request("async_recognize", "POST", self.api_url + ASYNC_RECOGNIZE_PATH, json={
+                "options": {
+                    "model": model,
+                    "language": language,
+                    "audio_encoding": audio_encoding,
+                    "sample_rate": sample_rate,
+                    "channels_count": 1,
+                },
+                "request_file_id": request_file_id,
+            })
+            task_id = response.json()["result"]["id"]
+            logger.info(f"Создана задача асинхронного распознавания {task_id}")
+            return task_id
+        except Exception as e:
+            logger.error(f"Ошибка при создании задачи асинхронного распознавания: {e}")
+            raise
+
+    async def finish_async(self, task_id, on_status=None):
+        # Ждёт задачу и скачивает результат. on_status(статус) вызывается после каждого опроса: NEW, RUNNING, DONE
+        try:
+            response_file_id = await self._wait_task(task_id, on_status)
+            response = await self._request(
+                "download", "GET", self.api_url + DOWNLOAD_PATH, params={"response_file_id": response_file_id}
+            )
+            hypotheses = self._async_hypotheses(response.json())
+            return Recognition(
+                " ".join(filter(None, (h.get("normalized_text") or h.get("text", "") for h in hypotheses))), hypotheses
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при асинхронном распознавании аудио: {e}")
+            raise
+
+    async def recognize_async(self, audio_content, on_status=None, **options):
+        return await self.finish_async(await self.start_async(audio_content, **options), on_status)
+
+    async def _wait_task(self, task_id, on_status=None):
+        deadline = time.monotonic() + self.async_timeout
+        while True:
+            response = await self._request("task", "GET", self.api_url + TASK_PATH, params={"id": task_id})
+            task = response.json()["result"]
+            if on_status is not None:
+                on_status(task["status"])
+            if task["status"] == "DONE":
+                return task["response_file_id"]
+            if task["status"] in ("ERROR", "CANCELED"):
+                raise Exception(f"Задача {task_id} завершилась со статусом {task['status']}: {task.get('error', '')}")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Задача {task_id} не завершилась за {self.async_timeout:.0f} с")
+            await asyncio.sleep(self.async_poll_interval)
+
+    @staticmethod
+    def _async_hypotheses(results):
+        # Лучшая гипотеза каждой фразы; если у гипотезы нет своих меток, берём границы обработанного куска
+        hypotheses = []
+        for utterance in results:
+            for hypothesis in utterance.get("results", [])[:1]:
+                hypothesis = dict(hypothesis)
+                hypothesis.setdefault("start", utterance.get("processed_audio_start"))
+                hypothesis.setdefault("end", utterance.get("processed_audio_end"))
+                hypotheses.append(hypothesis)
+        return hypotheses
+
+    async def close(self):
+        await self.tokens.close()
+        if self._http is not None and not self._http.is_closed:
+            await self._http.aclose()
+        self._http = None
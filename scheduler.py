@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Ограничение параллельных запросов на распознавание"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class RecognitionScheduler:
+    """Глобальный и пользовательский лимиты одновременных распознаваний.
+
+    Сначала занимается слот пользователя и только потом глобальный, чтобы
+    фрагменты, ожидающие своей очереди внутри одного задания, не держали
+    общую квоту Salute Speech и не мешали остальным пользователям.
+    """
+
+    def __init__(self, global_limit, per_user_limit):
+        self.global_limit = global_limit
+        self.per_user_limit = per_user_limit
+        self._global = asyncio.Semaphore(global_limit)
+        self._users = {}
+
+    def _acquire_user(self, user_id):
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = [asyncio.Semaphore(self.per_user_limit), 0]
+            self._users[user_id] = entry
+        entry[1] += 1
+        return entry[0]
+
+    def _release_user(self, user_id):
+        entry = self._users[user_id]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._users[user_id]
+
+    @asynccontextmanager
+    async def slot(self, user_id=None):
+        user_semaphore = self._acquire_user(user_id)
+        try:
+            async with user_semaphore:
+                async with self._global:
+                    yield
+        finally:
+            self._release_user(user_id)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Проверки и прогрев при запуске процесса, готовность к работе"""
+
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Декодеры форматов, которые принимает бот (mp3, ogg, wav, m4a/aac, flac, wma), и кодеры для PCM и FLAC
+REQUIRED_DECODERS = ("mp3", "opus", "vorbis", "aac", "flac", "pcm_s16le", "wmav2")
+REQUIRED_ENCODERS = ("flac", "pcm_s16le")
+
+
+async def _ffmpeg_output(ffmpeg_bin, *args):
+    proc = await asyncio.create_subprocess_exec(
+        ffmpeg_bin, "-hide_banner", *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(stderr.decode(errors="replace").strip() or f"код {proc.returncode}")
+    return stdout.decode(errors="replace")
+
+
+def _codec_names(listing):
+    # Список -decoders/-encoders: легенда, строка "------", затем "<флаги> <имя> <описание>"
+    names = set()
+    started = False
+    for line in listing.splitlines():
+        if line.strip().startswith("------"):
+            started = True
+        elif started and line.split():
+            names.add(line.split()[1])
+    return names
+
+
+async def check_ffmpeg(ffmpeg_bin):
+    """Версия ffmpeg и список недостающих кодеков; исключение, если ffmpeg не запускается.
+
+    Заодно первый запуск ffmpeg поднимает бинарник и библиотеки в кэш
+    страниц, и первое задание не платит за холодный старт.
+    """
+    version = (await _ffmpeg_output(ffmpeg_bin, "-version")).splitlines()[0]
+    decoders = _codec_names(await _ffmpeg_output(ffmpeg_bin, "-decoders"))
+    encoders = _codec_names(await _ffmpeg_output(ffmpeg_bin, "-encoders"))
+    missing = [f"декодер {name}" for name in REQUIRED_DECODERS if name not in decoders]
+    missing += [f"кодер {name}" for name in REQUIRED_ENCODERS if name not in encoders]
+    return version, missing
+
+
+class Startup:
+    """Длительность этапов запуска и готовность процесса принимать работу.
+
+    Процесс готов, когда прогрев завершён (ready) и выполнены все условия,
+    добавленные через wait_for, например готовность процессов-обработчиков.
+    """
+
+    def __init__(self, import_seconds=None):
+        self.started = time.monotonic()
+        self.phases = {}
+        if import_seconds is not None:
+            self.phases["import"] = import_seconds
+        self.ready = False
+        self._conditions = []
+
+    @contextmanager
+    def phase(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.monotonic() - started
+
+    def wait_for(self, condition):
+        self._conditions.append(condition)
+
+    def is_ready(self):
+        return self.ready and all(condition() for condition in self._conditions)
+
+    def summary(self):
+        return ", ".join(f"{name} {seconds:.2f} с" for name, seconds in self.phases.items())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Субтитры SRT/VTT и JSON с временными метками из результатов Salute Speech"""
+
+import json
+from collections import namedtuple
+
+FORMATS = ("srt", "vtt", "json")
+
+# Время в секундах от начала записи. words — список Word, пустой, если API не вернул разметку слов
+Segment = namedtuple("Segment", ["start", "end", "text", "words"])
+Word = namedtuple("Word", ["start", "end", "word"])
+
+# Субтитр — не больше двух строк по 42 символа и не дольше 7 секунд;
+# пауза между словами длиннее MAX_WORD_GAP всегда начинает новый субтитр
+MAX_CUE_CHARS = 84
+MAX_CUE_DURATION = 7.0
+MAX_WORD_GAP = 1.0
+
+
+def parse_time(value):
+    # Salute Speech пишет длительности как "1.120s"
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip().removesuffix("s")
+    return float(value)
+
+
+def _split_words(words):
+    # Группирует слова с метками в субтитры по длине, длительности и паузам
+    cue = []
+    for word in words:
+        if cue and (
+            len(" ".join(w.word for w in cue)) + 1 + len(word.word) > MAX_CUE_CHARS
+            or word.end - cue[0].start > MAX_CUE_DURATION
+            or word.start - cue[-1].end > MAX_WORD_GAP
+        ):
+            yield Segment(cue[0].start, cue[-1].end, " ".join(w.word for w in cue), cue)
+            cue = []
+        cue.append(word)
+    if cue:
+        yield Segment(cue[0].start, cue[-1].end, " ".join(w.word for w in cue), cue)
+
+
+def _split_text(text, start, end):
+    # Без разметки слов время делится между частями текста пропорционально числу символов.
+    # Фрагменты режутся по паузам, так что ошибка не выходит за границы фрагмента
+    words = text.split()
+    if not words:
+        return
+    pieces = []
+    cue = []
+    for word in words:
+        if cue and len(" ".join(cue)) + 1 + len(word) > MAX_CUE_CHARS:
+            pieces.append(" ".join(cue))
+            cue = []
+        cue.append(word)
+        # Конец предложения закрывает субтитр, если он уже не слишком короткий
+        if word[-1] in ".?!" and len(" ".join(cue)) >= MAX_CUE_CHARS // 3:
+            pieces.append(" ".join(cue))
+            cue = []
+    if cue:
+        pieces.append(" ".join(cue))
+    total = sum(len(piece) for piece in pieces)
+    position = start
+    for piece in pieces:
+        piece_end = position + (end - start) * len(piece) / total
+        yield Segment(position, piece_end, piece, [])
+        position = piece_end
+
+
+def hypothesis_segments(hypotheses, offset=0.0, duration=None):
+    """Субтитры из гипотез Salute Speech со сдвигом offset секунд.
+
+    Гипотеза — словарь с text/normalized_text и, если API их вернул,
+    start/end и word_alignments. Без меток время текста растягивается на
+    весь интервал [offset, offset + duration].
+    """
+    for hypothesis in hypotheses:
+        text = hypothesis.get("normalized_text") or hypothesis.get("text", "")
+        words = [
+            Word(offset + parse_time(word["start"]), offset + parse_time(word["end"]), word["word"])
+            for word in hypothesis.get("word_alignments") or []
+            if word.get("word") and word.get("start") is not None and word.get("end") is not None
+        ]
+        if words:
+            cues = list(_split_words(words))
+            if len(cues) == 1:
+                # Короткая фраза целиком: нормализованный текст с пунктуацией читается лучше слов разметки
+                cues = [cues[0]._replace(text=text or cues[0].text)]
+            yield from cues
+            continue
+        start = parse_time(hypothesis.get("start"))
+        end = parse_time(hypothesis.get("end"))
+        if start is not None and end is not None:
+            yield from _split_text(text, offset + start, offset + end)
+        elif duration:
+            yield from _split_text(text, offset, offset + duration)
+
+
+def format_timestamp(seconds, separator):
+    milliseconds = max(0, int(round(seconds * 1000)))
+    hours, milliseconds = divmod(milliseconds, 3600 * 1000)
+    minutes, milliseconds = divmod(milliseconds, 60 * 1000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+class SubtitleWriter:
+    """Пишет субтитры в поток по мере готовности фрагментов.
+
+    Субтитры нужно добавлять в порядке времени; в памяти не держится ничего,
+    кроме счётчика, поэтому размер записи не влияет на расход памяти.
+    """
+
+    def __init__(self, stream, fmt):
+        if fmt not in FORMATS:
+            raise ValueError(f"Неизвестный формат субтитров: {fmt}")
+        self.stream = stream
+        self.format = fmt
+        self.count = 0
+        if fmt == "vtt":
+            stream.write("WEBVTT\n\n")
+        elif fmt == "json":
+            stream.write("[")
+
+    def add(self, segments):
+        for segment in segments:
+            if not segment.text:
+                continue
+            self.count += 1
+            if self.format == "json":
+                item = {
+                    "start": round(segment.start, 3),
+                    "end": round(segment.end, 3),
+                    "text": segment.text,
+                    "words": [
+                        {"start": round(word.start, 3), "end": round(word.end, 3), "word": word.word}
+                        for word in segment.words
+                    ],
+                }
+                separator = "\n" if self.count == 1 else ",\n"
+                self.stream.write(separator + json.dumps(item, ensure_ascii=False))
+                continue
+            separator = "," if self.format == "srt" else "."
+            timing = f"{format_timestamp(segment.start, separator)} --> {format_timestamp(segment.end, separator)}"
+            # Номер субтитра обязателен в SRT и допустим в VTT
+            self.stream.write(f"{self.count}\n{timing}\n{segment.text}\n\n")
+
+    def close(self):
+        if self.format == "json":
+            self.stream.write("\n]\n")
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Идентификатор задания в строках лога"""
+
+import logging
+import contextvars
+
+# contextvars копируются в задачи asyncio при создании, поэтому идентификатор,
+# выставленный в начале задания, виден и в задачах распознавания его фрагментов
+trace_id = contextvars.ContextVar("trace_id", default="-")
+
+
+def set_trace_id(value):
+    return trace_id.set(value)
+
+
+class TraceIdFilter(logging.Filter):
+    """Добавляет к записям лога поле trace_id для формата "%(trace_id)s" """
+
+    def filter(self, record):
+        record.trace_id = trace_id.get()
+        return True
+
+
+def install(logger=None):
+    # Фильтр ставится на обработчики, а не на логгер: так он срабатывает и для записей дочерних логгеров
+    for handler in (logger or logging.getLogger()).handlers:
+        handler.addFilter(TraceIdFilter())
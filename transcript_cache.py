@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Постоянный кэш распознанных текстов"""
+
+import time
+import sqlite3
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptCache:
+    """Кэш текстов в SQLite с вытеснением по сроку жизни и общему размеру.
+
+    Ключ имеет вид "<вид>:<значение>", например "file:<file_unique_id>" или
+    "pcm:<sha256>"; попадания и промахи считаются отдельно по каждому виду.
+    Соединение открывается лениво, поэтому объект можно создавать до fork.
+    """
+
+    def __init__(self, path, max_bytes=200 * 1024 * 1024, ttl=30 * 24 * 3600, evict_every=100):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evict_every = evict_every
+        self.hits = Counter()
+        self.misses = Counter()
+        self._db = None
+        self._writes = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=10)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS transcripts_accessed_at ON transcripts(accessed_at)")
+            self._db.commit()
+        return self._db
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        kind = key.split(":", 1)[0]
+        try:
+            db = self._connect()
+            row = db.execute("SELECT value, created_at FROM transcripts WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is None or row[1] < now - self.ttl:
+                self.misses[kind] += 1
+                return None
+            db.execute("UPDATE transcripts SET accessed_at = ? WHERE key = ?", (now, key))
+            db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка чтения кэша распознавания: {e}")
+            self.misses[kind] += 1
+            return None
+        self.hits[kind] += 1
+        return row[0]
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        now = time.time()
+        try:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO transcripts (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")) + len(key), now, now)
+            )
+            db.commit()
+            self._writes += 1
+            if self._writes % self.evict_every == 0:
+                self.evict()
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка записи в кэш распознавания: {e}")
+
+    def evict(self):
+        db = self._connect()
+        db.execute("DELETE FROM transcripts WHERE created_at < ?", (time.time() - self.ttl,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM transcripts").fetchone()[0]
+        if total > self.max_bytes:
+            # Удаляем давно не использовавшиеся записи, пока не освободим 10% запаса
+            target = self.max_bytes * 0.9
+            keys = []
+            for key, size in db.execute("SELECT key, size FROM transcripts ORDER BY accessed_at"):
+                if total <= target:
+                    break
+                keys.append((key,))
+                total -= size
+            db.executemany("DELETE FROM transcripts WHERE key = ?", keys)
+            logger.info(f"Из кэша распознавания вытеснено записей: {len(keys)}")
+        db.commit()
+
+    def stats(self):
+        kinds = sorted(set(self.hits) | set(self.misses))
+        return {kind: {"hits": self.hits[kind], "misses": self.misses[kind]} for kind in kinds}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
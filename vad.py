@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Поиск тихих участков в PCM для выбора границ фрагментов"""
+
+import numpy as np
+
+
+def frame_rms(samples, frame_samples):
+    """RMS-энергия по кадрам фиксированной длины (хвост короче кадра отбрасывается)"""
+    frames_count = len(samples) // frame_samples
+    frames = samples[:frames_count * frame_samples].reshape(frames_count, frame_samples).astype(np.float32)
+    return np.sqrt(np.mean(np.square(frames), axis=1))
+
+
+def find_cut_point(pcm, search_start, frame_samples=320, smooth_frames=10):
+    """Номер сэмпла в pcm (s16le моно), на котором лучше всего резать.
+
+    Ищется самое тихое место в окне от search_start до конца буфера.
+    Энергия сглаживается скользящим средним, чтобы предпочитать паузы,
+    а не короткие провалы внутри слова. Из одинаково тихих мест берётся
+    самое позднее, чтобы фрагменты получались как можно длиннее.
+    """
+    samples = np.frombuffer(pcm, dtype="<i2")
+    rms = frame_rms(samples[search_start:], frame_samples)
+    if len(rms) == 0:
+        return len(samples)
+    if smooth_frames > 1:
+        # Скользящее среднее с нормировкой на число кадров у краёв окна,
+        # иначе края выглядят тише середины
+        kernel = np.ones(smooth_frames, dtype=np.float32)
+        rms = np.convolve(rms, kernel, mode="same") / np.convolve(np.ones_like(rms), kernel, mode="same")
+    # «Одинаково тихие» — в пределах 10% от минимума (плюс 1 на цифровой ноль)
+    quietest = int(np.flatnonzero(rms <= rms.min() * 1.1 + 1)[-1])
+    return search_start + quietest * frame_samples + frame_samples // 2